@@ -0,0 +1,367 @@
+import logging
+import time
+from collections import OrderedDict
+import numpy as np
+from algorithms.StupidMove import StupidMove
+log = logging.getLogger(__name__)
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class AlphaBeta():
+    """
+    Iterative-deepening alpha-beta search over State objects (env.get_state(return_object=True))
+    with push()/pop(). The agents of a player move one after the other, so the side to move only
+    changes every num_agents plies and the values are negated on player switches only.
+    Moves are ordered by the transposition table move, then by the StupidMove heuristic.
+    The search stops at the deadline and returns the best move of the last completed depth.
+    Once at most endgame_plies plies are left, the EndgameSolver takes over with half of the time.
+    """
+    def __init__(self, n_actions: int = 13, num_agents: int = 2, time_limit: float = 1.0,
+                 max_depth: int = 64, max_entries: int = 1000000, endgame_plies: int = 0) -> None:
+        self.n_actions = n_actions
+        self.num_agents = num_agents
+        self.time_limit = time_limit
+        self.max_depth = max_depth
+        self.max_entries = max_entries
+        self.endgame_plies = endgame_plies
+        self.endgame = EndgameSolver(n_actions=n_actions, num_agents=num_agents,
+                                     max_entries=max_entries) if endgame_plies > 0 else None
+        self.heuristic = StupidMove(n_actions=n_actions, num_agents=num_agents)
+        self.table = OrderedDict()
+        self.game_key = None
+        self.stats = {}
+
+    def reset(self):
+        self.table.clear()
+        self.game_key = None
+
+    def evaluate(self, state):
+        """
+        Score difference from the point of view of the player to move
+        """
+        scores = state.scores
+        player = state.current_player
+        return float(scores[player] - scores[1 - player])
+
+    def ordered_actions(self, state, first=None):
+        obs = state.get_state()
+        scores = self.heuristic.score_actions(obs)
+        actions = [action for action in range(self.n_actions - 1) if obs['valid_actions'][action]]
+        if not actions:
+            actions = [self.n_actions - 1]
+        actions.sort(key=lambda action: -scores[action])
+        if first in actions:
+            actions.remove(first)
+            actions.insert(0, first)
+        return actions
+
+    def probe(self, key):
+        self.n_probes += 1
+        entry = self.table.get(key)
+        if entry is not None:
+            self.n_hits += 1
+            self.table.move_to_end(key)
+        return entry
+
+    def store(self, key, depth, value, flag, action):
+        self.table[key] = (depth, value, flag, action)
+        self.table.move_to_end(key)
+        if len(self.table) > self.max_entries:
+            self.table.popitem(last=False)
+
+    def negamax(self, state, depth, alpha, beta):
+        """
+        Returns the value of the state for the player to move, searched depth plies ahead
+        """
+        self.n_nodes += 1
+        if self.n_nodes % 64 == 0 and time.time() > self.deadline:
+            raise SearchTimeout()
+        if state.is_terminal() or depth == 0:
+            return self.evaluate(state)
+
+        key = (state.zobrist_hash, state.remaining_turns)
+        entry = self.probe(key)
+        tt_action = None
+        if entry is not None:
+            entry_depth, value, flag, tt_action = entry
+            if entry_depth >= depth:
+                if flag == EXACT:
+                    return value
+                if flag == LOWER and value >= beta:
+                    return value
+                if flag == UPPER and value <= alpha:
+                    return value
+
+        alpha_orig = alpha
+        player = state.current_player
+        best_value, best_action = -float('inf'), None
+        for action in self.ordered_actions(state, tt_action):
+            state.push(action)
+            try:
+                if state.current_player == player:
+                    value = self.negamax(state, depth - 1, alpha, beta)
+                else:
+                    value = -self.negamax(state, depth - 1, -beta, -alpha)
+            finally:
+                state.pop()
+            if value > best_value:
+                best_value, best_action = value, action
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= alpha_orig:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.store(key, depth, best_value, flag, best_action)
+        return best_value
+
+    def search(self, state):
+        """
+        Deepens until the deadline, returns (best action, value) of the deepest completed search
+        """
+        game_key = (state.height, state.width, state.castles.tobytes(), state.ponds.tobytes(), state.n_turns)
+        if game_key != self.game_key:
+            self.reset()
+            self.game_key = game_key
+        start = time.time()
+        self.deadline = start + self.time_limit
+        if self.endgame is not None and state.remaining_plies() <= self.endgame_plies:
+            try:
+                # half of the time, the other half is left to the search if it is not solved
+                action, value = self.endgame.solve(state, start + self.time_limit / 2)
+                self.stats = dict(self.endgame.stats, depth=state.remaining_plies())
+                log.info('Endgame solved: {} plies in {:.3f}s, value {}'.format(
+                    self.stats['plies'], self.stats['time'], value))
+                return action, value
+            except SearchTimeout:
+                log.info('Endgame of {} plies not solved in time, searching with the remaining time'.format(
+                    state.remaining_plies()))
+        self.n_nodes = self.n_probes = self.n_hits = 0
+        actions = self.ordered_actions(state)
+        best_action, best_value, depth_reached = actions[0], None, 0
+        player = state.current_player
+        try:
+            for depth in range(1, self.max_depth + 1):
+                alpha, beta = -float('inf'), float('inf')
+                iteration_action = None
+                for action in actions:
+                    state.push(action)
+                    try:
+                        if state.current_player == player:
+                            value = self.negamax(state, depth - 1, alpha, beta)
+                        else:
+                            value = -self.negamax(state, depth - 1, -beta, -alpha)
+                    finally:
+                        state.pop()
+                    if value > alpha:
+                        alpha, iteration_action = value, action
+                best_action, best_value, depth_reached = iteration_action, alpha, depth
+                # the next iteration starts with the best move found so far
+                actions.remove(best_action)
+                actions.insert(0, best_action)
+                if depth >= state.remaining_plies():
+                    break
+        except SearchTimeout:
+            pass
+        elapsed = max(time.time() - start, 1e-9)
+        self.stats = {
+            'depth': depth_reached,
+            'nodes': self.n_nodes,
+            'time': elapsed,
+            'nodes-per-second': self.n_nodes / elapsed,
+            'tt-probes': self.n_probes,
+            'tt-hits': self.n_hits,
+            'tt-hit-rate': self.n_hits / max(self.n_probes, 1),
+            'tt-size': len(self.table),
+            'value': best_value,
+        }
+        log.debug('AlphaBeta: depth {depth}, {nodes} nodes, {nodes-per-second:.0f} nodes/s, '
+                  'tt hit rate {tt-hit-rate:.2f}'.format(**self.stats))
+        return best_action, best_value
+
+    def get_action(self, state, epsilon=0.0):
+        action, _ = self.search(state)
+        return action
+
+
+class EndgameSolver(AlphaBeta):
+    """
+    Exact alpha-beta search to the end of the game, over the actions of AlphaBeta and staying.
+    A node is cut when the range of final score differences still reachable from it, bounded
+    from the remaining own and opponent plies with the alpha/beta/gamma weights of the scores,
+    lies outside the window
+    """
+    def __init__(self, n_actions: int = 13, num_agents: int = 2, time_limit: float = None,
+                 max_entries: int = 1000000) -> None:
+        super().__init__(n_actions=n_actions, num_agents=num_agents, time_limit=time_limit,
+                         max_entries=max_entries)
+
+    def remaining_plies(self, state):
+        """
+        Returns the number of plies left to the player to move and to its opponent
+        """
+        first = state.num_agents - state.agent_current_idx
+        turns = (state.remaining_plies() - first) // state.num_agents
+        return first + turns // 2 * state.num_agents, (turns + 1) // 2 * state.num_agents
+
+    def ordered_actions(self, state, first=None):
+        """
+        The actions of AlphaBeta and staying, which is the best play when the only valid
+        actions destroy own walls
+        """
+        actions = super().ordered_actions(state, first)
+        if self.n_actions - 1 not in actions:
+            actions.append(self.n_actions - 1)
+        return actions
+
+    def score_bounds(self, state, player, own_plies, opponent_plies):
+        """
+        Lowest and highest final score of the player over every line of the remaining plies.
+        Its walls change by one per ply at most. Destroying one of its walls may open its
+        enclosures, losing their castles and the territory under opponent walls, and every
+        opponent wall built may take one more cell of territory. Territory and castles are
+        gained by enclosing inner cells with its own walls, or the inner cell of a destroyed wall
+        """
+        score = state.scores[player]
+        plies = own_plies + opponent_plies
+        if plies == 0:
+            return score, score
+        walls = state.wall_scores[player]
+        territory = state.territory_scores[player]
+        castles = state.castle_scores[player]
+        own_walls = state.walls[player] == 1
+        territories = state.territories[player] == 1
+        under_opponent_walls = int((territories & (state.walls[1 - player] == 1)).sum())
+        low = score - state.alpha * min(walls, plies) - \
+            state.gamma * min(territory, under_opponent_walls + opponent_plies)
+        if walls > 0:
+            low -= state.beta * castles
+        high = score + state.gamma * min(plies, int((own_walls & self.inner).sum()))
+        if own_plies > 0:
+            high += state.alpha * own_plies + \
+                state.gamma * int((self.inner & ~territories & ~own_walls).sum()) + \
+                state.beta * (self.n_inner_castles - castles)
+        return low, high
+
+    def negamax(self, state, depth, alpha, beta):
+        """
+        Returns the exact final score difference for the player to move, depth is ignored
+        """
+        self.n_nodes += 1
+        if self.deadline is not None and self.n_nodes % 64 == 0 and time.time() > self.deadline:
+            raise SearchTimeout()
+        if state.is_terminal():
+            return self.evaluate(state)
+
+        player = state.current_player
+        own_plies, opponent_plies = self.remaining_plies(state)
+        own_low, own_high = self.score_bounds(state, player, own_plies, opponent_plies)
+        opponent_low, opponent_high = self.score_bounds(state, 1 - player, opponent_plies, own_plies)
+        if own_high - opponent_low <= alpha:
+            self.n_cutoffs += 1
+            return float(own_high - opponent_low)
+        if own_low - opponent_high >= beta:
+            self.n_cutoffs += 1
+            return float(own_low - opponent_high)
+
+        key = (state.zobrist_hash, state.remaining_turns)
+        entry = self.probe(key)
+        tt_action = None
+        if entry is not None:
+            _, value, flag, tt_action = entry
+            if flag == EXACT:
+                return value
+            if flag == LOWER and value >= beta:
+                return value
+            if flag == UPPER and value <= alpha:
+                return value
+
+        alpha_orig = alpha
+        best_value, best_action = -float('inf'), None
+        for action in self.ordered_actions(state, tt_action):
+            state.push(action)
+            try:
+                if state.current_player == player:
+                    value = self.negamax(state, depth, alpha, beta)
+                else:
+                    value = -self.negamax(state, depth, -beta, -alpha)
+            finally:
+                state.pop()
+            if value > best_value:
+                best_value, best_action = value, action
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= alpha_orig:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.store(key, 0, best_value, flag, best_action)
+        return best_value
+
+    def solve(self, state, deadline=None):
+        """
+        Returns the best action and the exact final score difference for the player to move,
+        raises SearchTimeout if the deadline is reached first
+        """
+        game_key = (state.height, state.width, state.castles.tobytes(), state.ponds.tobytes(), state.n_turns)
+        if game_key != self.game_key:
+            self.reset()
+            self.game_key = game_key
+        start = time.time()
+        if deadline is None and self.time_limit is not None:
+            deadline = start + self.time_limit
+        self.deadline = deadline
+        self.n_nodes = self.n_probes = self.n_hits = self.n_cutoffs = 0
+        # cells off the border, the only ones that can be enclosed
+        self.inner = np.zeros((state.height, state.width), dtype=bool)
+        self.inner[1:-1, 1:-1] = True
+        self.n_inner_castles = int((self.inner & (state.castles == 1)).sum())
+        plies = state.remaining_plies()
+        player = state.current_player
+        best_action, alpha = None, -float('inf')
+        try:
+            for action in self.ordered_actions(state):
+                state.push(action)
+                try:
+                    if state.current_player == player:
+                        value = self.negamax(state, 0, alpha, float('inf'))
+                    else:
+                        value = -self.negamax(state, 0, -float('inf'), -alpha)
+                finally:
+                    state.pop()
+                if value > alpha:
+                    alpha, best_action = value, action
+        finally:
+            elapsed = max(time.time() - start, 1e-9)
+            self.stats = {
+                'plies': plies,
+                'solved': best_action is not None and (deadline is None or time.time() <= deadline),
+                'nodes': self.n_nodes,
+                'time': elapsed,
+                'nodes-per-second': self.n_nodes / elapsed,
+                'tt-probes': self.n_probes,
+                'tt-hits': self.n_hits,
+                'tt-hit-rate': self.n_hits / max(self.n_probes, 1),
+                'bound-cutoffs': self.n_cutoffs,
+                'tt-size': len(self.table),
+                'value': alpha,
+            }
+            log.debug('EndgameSolver: {plies} plies in {time:.3f}s, {nodes} nodes, '
+                      '{bound-cutoffs} bound cutoffs'.format(**self.stats))
+        return best_action, alpha
+
+    def search(self, state):
+        return self.solve(state)
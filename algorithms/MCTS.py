@@ -0,0 +1,344 @@
+import logging
+import math
+import multiprocessing
+import random
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy as dcopy
+import numpy as np
+log = logging.getLogger(__name__)
+
+
+class Node():
+    """
+    Statistics of a position, the visits and values are stored per action
+    from the point of view of the player to move
+    """
+    def __init__(self, state):
+        self.player = state.current_player
+        actions = np.flatnonzero(state.valid_action_mask())
+        if len(actions) == 0:
+            # the agent is stuck, any action just passes the turn
+            actions = [state.n_actions - 1]
+        self.actions = [int(a) for a in actions]
+        self.visits = 0
+        self.action_visits = [0] * len(self.actions)
+        self.action_values = [0.0] * len(self.actions)
+
+
+class MCTS():
+    """
+    UCT search over State objects (env.get_state(return_object=True)), walking a single
+    state with push()/pop(). Positions are shared through a transposition table keyed by
+    the Zobrist hash and the remaining turns, bounded to max_nodes with LRU eviction. The table is kept between
+    calls of the same game, so the subtree of the new position is reused.
+    """
+    def __init__(self, n_actions: int = 13, num_agents: int = 2, time_limit: float = 1.0,
+                 n_simulations: int = None, exploration: float = 1.4, rollout_depth: int = 20,
+                 score_scale: float = 20.0, max_nodes: int = 200000, fast_rollouts: bool = True) -> None:
+        self.n_actions = n_actions
+        self.num_agents = num_agents
+        self.time_limit = time_limit
+        self.n_simulations = n_simulations
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.score_scale = score_scale
+        self.max_nodes = max_nodes
+        self.fast_rollouts = fast_rollouts
+        self.table = OrderedDict()
+        self.game_key = None
+        self.stats = {}
+
+    def reset(self):
+        self.table.clear()
+        self.game_key = None
+
+    def key(self, state):
+        # the hash does not change when all the agents stay for a round
+        return state.zobrist_hash, state.remaining_turns
+
+    def lookup(self, state):
+        key = self.key(state)
+        node = self.table.get(key)
+        if node is not None:
+            self.table.move_to_end(key)
+        return node
+
+    def store(self, state):
+        node = Node(state)
+        self.table[self.key(state)] = node
+        if len(self.table) > self.max_nodes:
+            self.table.popitem(last=False)
+        return node
+
+    def evaluate(self, state, player):
+        """
+        Value in [-1, 1] of the state for the given player, exact at the end of the game
+        """
+        scores = state.scores
+        diff = scores[player] - scores[1 - player]
+        if state.is_terminal():
+            return float(np.sign(diff))
+        return math.tanh(diff / self.score_scale)
+
+    def select(self, node):
+        log_visits = math.log(node.visits + 1)
+        best_score, best_idx = -math.inf, 0
+        for idx in range(len(node.actions)):
+            visits = node.action_visits[idx]
+            if visits == 0:
+                return idx
+            score = node.action_values[idx] / visits + self.exploration * math.sqrt(log_visits / visits)
+            if score > best_score:
+                best_score, best_idx = score, idx
+        return best_idx
+
+    def rollout(self, state, player):
+        if self.fast_rollouts:
+            state.set_rollout_mode(True)
+        depth = 0
+        while depth < self.rollout_depth and not state.is_terminal():
+            actions = np.flatnonzero(state.valid_action_mask())
+            state.push(int(random.choice(actions)) if len(actions) > 0 else self.n_actions - 1)
+            depth += 1
+        if self.fast_rollouts:
+            state.update_score()
+        value = self.evaluate(state, player)
+        for _ in range(depth):
+            state.pop()
+        if self.fast_rollouts:
+            state.set_rollout_mode(False)
+        return value
+
+    def simulate(self, state, root_player):
+        """
+        Runs one selection-expansion-rollout-backup pass from the root state
+        """
+        path = []
+        node = self.lookup(state)
+        while node is not None and not state.is_terminal():
+            idx = self.select(node)
+            path.append((node, idx))
+            state.push(node.actions[idx])
+            node = self.lookup(state)
+        if node is None and not state.is_terminal():
+            self.store(state)
+            value = self.rollout(state, root_player)
+        else:
+            value = self.evaluate(state, root_player)
+        for node, idx in reversed(path):
+            state.pop()
+            node.visits += 1
+            node.action_visits[idx] += 1
+            node.action_values[idx] += value if node.player == root_player else -value
+        return len(path)
+
+    def search(self, state):
+        """
+        Searches from the state until the time limit or the number of simulations is reached,
+        returns the root node
+        """
+        game_key = (state.height, state.width, state.castles.tobytes(), state.ponds.tobytes(), state.n_turns)
+        if game_key != self.game_key:
+            self.reset()
+            self.game_key = game_key
+        root = self.lookup(state)
+        reused = root.visits if root is not None else 0
+        if root is None:
+            root = self.store(state)
+        root_player = state.current_player
+
+        start = time.time()
+        deadline = start + self.time_limit
+        n_simulations = 0
+        n_nodes = 0
+        while (self.n_simulations is None or n_simulations < self.n_simulations) and \
+                (self.time_limit is None or time.time() < deadline):
+            n_nodes += self.simulate(state, root_player) + 1
+            n_simulations += 1
+        elapsed = max(time.time() - start, 1e-9)
+        self.stats = {
+            'simulations': n_simulations,
+            'nodes': n_nodes,
+            'time': elapsed,
+            'nodes-per-second': n_nodes / elapsed,
+            'simulations-per-second': n_simulations / elapsed,
+            'reused-visits': reused,
+            'table-size': len(self.table),
+        }
+        log.debug('MCTS: {simulations} simulations, {nodes-per-second:.0f} nodes/s, '
+                  '{reused-visits} reused visits, {table-size} positions'.format(**self.stats))
+        return root
+
+    def get_action(self, state, epsilon=0.0):
+        root = self.search(state)
+        if epsilon > 0 and random.random() < epsilon:
+            return random.choice(root.actions)
+        best = max(range(len(root.actions)), key=lambda idx: root.action_visits[idx])
+        return root.actions[best]
+
+
+_worker_mcts = None
+
+def _init_worker(params):
+    global _worker_mcts
+    _worker_mcts = MCTS(**params)
+
+def _root_search(job):
+    """
+    Runs an independent search in a pool worker, the tree of the worker is kept for reuse
+    """
+    state, seed = job
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    root = _worker_mcts.search(state)
+    return dict(zip(root.actions, root.action_visits)), _worker_mcts.stats
+
+
+class ParallelMCTS(MCTS):
+    """
+    MCTS running on several workers for the same time budget.
+    mode='root' searches independent trees in a process pool and sums the visit counts
+    of the root actions, it is the mode that scales with the workers. mode='tree' shares
+    one tree between threads, each walking its own copy of the state; the edges on the path
+    of a running simulation carry a virtual loss so the other threads explore elsewhere.
+    The simulations are pure Python and hold the GIL, so tree mode runs about as many
+    simulations as a single thread whatever the number of workers; it spreads the
+    simulations of one tree over the workers and is kept for comparison.
+    The process pool of root mode is kept between searches, close() it or use the agent
+    in a with block.
+    """
+    modes = ('root', 'tree')
+
+    def __init__(self, n_actions: int = 13, num_agents: int = 2, workers: int = None,
+                 mode: str = 'root', virtual_loss: float = 1.0, **kwargs) -> None:
+        super().__init__(n_actions=n_actions, num_agents=num_agents, **kwargs)
+        if mode not in self.modes:
+            raise ValueError('Unknown parallel mode: {}, expected one of {}'.format(mode, self.modes))
+        self.workers = workers or multiprocessing.cpu_count()
+        self.mode = mode
+        self.virtual_loss = virtual_loss
+        self.params = dict(n_actions=n_actions, num_agents=num_agents, **kwargs)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # the workers are idle between searches, no need to wait for them
+        pool = getattr(self, 'pool', None)
+        if pool is not None:
+            pool.terminate()
+
+    def root_parallel_search(self, state):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers, _init_worker, (self.params,))
+        start = time.time()
+        seeds = [random.randrange(2 ** 63) for _ in range(self.workers)]
+        results = self.pool.map(_root_search, [(state, seed) for seed in seeds], chunksize=1)
+        visits = {}
+        for action_visits, _ in results:
+            for action, count in action_visits.items():
+                visits[action] = visits.get(action, 0) + count
+        elapsed = max(time.time() - start, 1e-9)
+        n_simulations = sum(stats['simulations'] for _, stats in results)
+        n_nodes = sum(stats['nodes'] for _, stats in results)
+        self.stats = {
+            'simulations': n_simulations,
+            'nodes': n_nodes,
+            'time': elapsed,
+            'nodes-per-second': n_nodes / elapsed,
+            'simulations-per-second': n_simulations / elapsed,
+            'workers': self.workers,
+        }
+        return visits
+
+    def simulate(self, state, root_player):
+        """
+        Same as MCTS.simulate, with the tree accesses under the lock and a virtual loss
+        on the path while the rollout runs
+        """
+        path = []
+        with self.lock:
+            node = self.lookup(state)
+            while node is not None and not state.is_terminal():
+                idx = self.select(node)
+                path.append((node, idx))
+                node.visits += self.virtual_loss
+                node.action_visits[idx] += self.virtual_loss
+                node.action_values[idx] -= self.virtual_loss
+                state.push(node.actions[idx])
+                node = self.lookup(state)
+            expand = node is None and not state.is_terminal()
+            if expand:
+                self.store(state)
+        if expand:
+            value = self.rollout(state, root_player)
+        else:
+            value = self.evaluate(state, root_player)
+        with self.lock:
+            for node, idx in reversed(path):
+                state.pop()
+                node.visits += 1 - self.virtual_loss
+                node.action_visits[idx] += 1 - self.virtual_loss
+                node.action_values[idx] += self.virtual_loss + (value if node.player == root_player else -value)
+        return len(path)
+
+    def tree_parallel_search(self, state):
+        game_key = (state.height, state.width, state.castles.tobytes(), state.ponds.tobytes(), state.n_turns)
+        if game_key != self.game_key:
+            self.reset()
+            self.game_key = game_key
+        root = self.lookup(state) or self.store(state)
+        root_player = state.current_player
+        deadline = time.time() + self.time_limit
+        counts = [[0, 0] for _ in range(self.workers)]
+
+        def run(worker):
+            local_state = dcopy(state)
+            while (self.n_simulations is None or sum(c[0] for c in counts) < self.n_simulations) and \
+                    time.time() < deadline:
+                counts[worker][1] += self.simulate(local_state, root_player) + 1
+                counts[worker][0] += 1
+
+        start = time.time()
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = max(time.time() - start, 1e-9)
+        n_simulations = sum(c[0] for c in counts)
+        n_nodes = sum(c[1] for c in counts)
+        self.stats = {
+            'simulations': n_simulations,
+            'nodes': n_nodes,
+            'time': elapsed,
+            'nodes-per-second': n_nodes / elapsed,
+            'simulations-per-second': n_simulations / elapsed,
+            'workers': self.workers,
+            'table-size': len(self.table),
+        }
+        return dict(zip(root.actions, root.action_visits))
+
+    def get_action(self, state, epsilon=0.0):
+        if self.mode == 'root':
+            visits = self.root_parallel_search(state)
+        else:
+            visits = self.tree_parallel_search(state)
+        log.debug('ParallelMCTS ({}, {} workers): {:.0f} simulations/s'.format(
+            self.mode, self.workers, self.stats['simulations-per-second']))
+        if epsilon > 0 and random.random() < epsilon:
+            return random.choice(list(visits))
+        return max(visits, key=visits.get)
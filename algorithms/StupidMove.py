@@ -40,7 +40,11 @@ class StupidMove():
         }
         
         
-    def get_action(self, state, epsilon=0.0):
+    def score_actions(self, state):
+        """
+        Returns the heuristic score of every action for the current agent of the state dict,
+        invalid actions score -1
+        """
         current_player_id = state['player-id']
         current_agent_id = state['current-agent-id']
         agent_board = state['observation'][[0, 3]]
@@ -129,6 +133,10 @@ class StupidMove():
                 scores[len(self.action_space['Move']) + j] = score
             
         scores[-1] = -0.9
+        return scores
+    
+    def get_action(self, state, epsilon=0.0):
+        scores = self.score_actions(state)
         max_score = max(scores)
         max_score_actions = [i for i in range(len(scores)) if scores[i] == max_score]
         action = random.choice(max_score_actions)
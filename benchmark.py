@@ -0,0 +1,164 @@
+"""
+Benchmarks of the engine and the agents.
+
+mcts-scaling: simulations per second of ParallelMCTS for 1 to N workers
+on the same positions and time budget.
+endgame: time of the exact EndgameSolver by number of remaining plies,
+to set the endgame_plies threshold of AlphaBeta.
+import-time: time of importing a module in a fresh interpreter, and the heavy
+dependencies it loads.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+from argparse import ArgumentParser
+import numpy as np
+from algorithms.AlphaBeta import EndgameSolver, SearchTimeout
+from algorithms.MCTS import MCTS, ParallelMCTS
+from src.environment import AgentFighting
+log = logging.getLogger(__name__)
+
+HEAVY_MODULES = ('pygame', 'torch', 'matplotlib', 'scipy')
+
+def argument_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--configs', default='configs/map.json')
+    parser.add_argument('--engine', choices=AgentFighting.engines.keys(), default='bitboard')
+    parser.add_argument('--seed', type=int, default=0)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scaling = subparsers.add_parser('mcts-scaling', help='Parallel MCTS playouts per second for 1..N workers')
+    scaling.add_argument('--max-workers', type=int, default=multiprocessing.cpu_count())
+    scaling.add_argument('--modes', nargs='+', choices=ParallelMCTS.modes, default=list(ParallelMCTS.modes))
+    scaling.add_argument('--time-limit', type=float, default=1.0, help='Seconds of search per position')
+    scaling.add_argument('--positions', type=int, default=3, help='Number of positions searched per worker count')
+
+    endgame = subparsers.add_parser('endgame', help='Exact endgame solve time by remaining plies')
+    endgame.add_argument('--max-plies', type=int, default=8)
+    endgame.add_argument('--positions', type=int, default=5, help='Number of positions per ply count')
+    endgame.add_argument('--time-limit', type=float, default=60.0, help='Seconds before a solve is abandoned')
+
+    import_time = subparsers.add_parser('import-time', help='Time of importing a module in a fresh interpreter')
+    import_time.add_argument('--module', default='src.environment')
+    import_time.add_argument('--repeat', type=int, default=5)
+    import_time.add_argument('--target', type=float, default=0.3,
+                             help='Seconds the median import time has to stay under')
+    return parser.parse_args()
+
+def sample_positions(configs, engine, n_positions, seed):
+    """
+    Returns State objects taken along one random game
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    env = AgentFighting(None, configs, render=False, engine=engine, seed=seed)
+    positions = []
+    while not env.is_terminal() and len(positions) < n_positions:
+        positions.append(env.get_state(return_object=True))
+        for _ in range(env.num_agents * 2):
+            if env.is_terminal():
+                break
+            env.step(int(np.random.choice(np.flatnonzero(env.get_valid_actions()))))
+    return positions
+
+def mcts_scaling(configs, engine, max_workers, modes, time_limit, n_positions, seed):
+    """
+    Returns {mode: [(workers, simulations per second, speedup)]}, the speedup being
+    relative to the single-threaded MCTS on the same positions
+    """
+    positions = sample_positions(configs, engine, n_positions, seed)
+
+    def rate(agent):
+        simulations, elapsed = 0, 0.0
+        for state in positions:
+            agent.reset()
+            agent.get_action(state)
+            simulations += agent.stats['simulations']
+            elapsed += agent.stats['time']
+        return simulations / elapsed
+
+    base = rate(MCTS(time_limit=time_limit))
+    log.info('MCTS (1 thread): {:.0f} simulations/s'.format(base))
+    curves = {}
+    for mode in modes:
+        curves[mode] = []
+        for workers in range(1, max_workers + 1):
+            with ParallelMCTS(workers=workers, mode=mode, time_limit=time_limit) as agent:
+                speed = rate(agent)
+            curves[mode].append((workers, speed, speed / base))
+            log.info('{} parallel, {:2d} workers: {:.0f} simulations/s, speedup {:.2f}, efficiency {:.2f}'.format(
+                mode, workers, speed, speed / base, speed / base / workers))
+    return curves
+
+def endgame_positions(configs, engine, plies, n_positions, seed):
+    """
+    Returns State objects with the given number of remaining plies, taken from random games
+    """
+    positions = []
+    for game in range(n_positions):
+        random.seed(seed + game)
+        np.random.seed(seed + game)
+        env = AgentFighting(None, configs, render=False, engine=engine, seed=seed + game)
+        while env.state.remaining_plies() > plies:
+            env.step(int(np.random.choice(np.flatnonzero(env.get_valid_actions()))))
+        positions.append(env.get_state(return_object=True))
+    return positions
+
+def endgame_times(configs, engine, max_plies, n_positions, time_limit, seed):
+    """
+    Returns [(plies, mean solve time, max solve time, mean nodes, number of unsolved positions)]
+    """
+    rows = []
+    for plies in range(1, max_plies + 1):
+        times, nodes, unsolved = [], [], 0
+        for state in endgame_positions(configs, engine, plies, n_positions, seed):
+            solver = EndgameSolver(time_limit=time_limit)
+            try:
+                solver.solve(state)
+            except SearchTimeout:
+                unsolved += 1
+            times.append(solver.stats['time'])
+            nodes.append(solver.stats['nodes'])
+        rows.append((plies, float(np.mean(times)), float(np.max(times)), float(np.mean(nodes)), unsolved))
+        log.info('{:2d} plies: mean {:.3f}s, max {:.3f}s, {:.0f} nodes, {} unsolved'.format(*rows[-1]))
+    return rows
+
+def import_times(module, repeat):
+    """
+    Returns the import times of the module, each in a new interpreter started from the
+    directory of this script, and the heavy modules the import loaded
+    """
+    code = ('import json, sys, time; start = time.perf_counter(); import {}; '
+            'print(json.dumps([time.perf_counter() - start, '
+            '[name for name in {} if name in sys.modules]]))').format(module, HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        elapsed, loaded = json.loads(output.splitlines()[-1])
+        times.append(elapsed)
+    return times, loaded
+
+def main():
+    args = argument_parser()
+    configs = json.load(open(args.configs))
+    if args.command == 'mcts-scaling':
+        mcts_scaling(configs, args.engine, args.max_workers, args.modes,
+                     args.time_limit, args.positions, args.seed)
+    elif args.command == 'endgame':
+        endgame_times(configs, args.engine, args.max_plies, args.positions, args.time_limit, args.seed)
+    elif args.command == 'import-time':
+        times, loaded = import_times(args.module, args.repeat)
+        median = float(np.median(times))
+        log.info('import {}: median {:.3f}s, min {:.3f}s, max {:.3f}s, heavy modules loaded: {}'.format(
+            args.module, median, min(times), max(times), ', '.join(loaded) or 'none'))
+        if median > args.target:
+            log.error('import {} takes more than {:.3f}s'.format(args.module, args.target))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -8,10 +8,31 @@ BG_COLOR = (245, 245, 245)
 LINE_COLOR = (0, 0, 0)
 CIRCLE_COLOR = (239, 231, 200)
 CROSS_COLOR = (66, 66, 66)
+
+# fonts and scaled sprites are loaded once per process
+_fonts = {}
+_sprites = {}
+
+def get_font(name, size):
+    if (name, size) not in _fonts:
+        _fonts[(name, size)] = pygame.font.SysFont(name, size)
+    return _fonts[(name, size)]
+
+def get_sprite(path, size):
+    if (path, size) not in _sprites:
+        _sprites[(path, size)] = pygame.transform.scale(pygame.image.load(path), size)
+    return _sprites[(path, size)]
     
 class Screen():
-    def __init__(self, render=True):
+    def __init__(self, render=True, offscreen=False):
+        """
+        offscreen: draws on a Surface instead of a window, through the SDL dummy video driver
+        unless the display is already open
+        """
+        self.offscreen = offscreen
         if render:
+            if offscreen and not pygame.display.get_init():
+                os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
             pygame.init()
             self.WIDTH = 500
             self.HEIGHT = 500
@@ -21,47 +42,63 @@ class Screen():
             self.color_B = (129, 188, 255)
             self.dir_path = os.path.dirname(os.path.realpath(__file__))
             self.load_image()
-            pygame.display.set_caption( 'ProCon-2023' ) 
+            if not offscreen:
+                pygame.display.set_caption( 'ProCon-2023' ) 
             self.board = None
+            self.dirty_rects = None # None: the whole display has to be updated
+            self.score_texts = None
 
     def init(self, state): 
         self.height = state.height
         self.width = state.width
         self.board = np.zeros((self.height, self.width), dtype=np.uint8)
-        self.screen = pygame.display.set_mode(self.coord(self.height, self.width + 3))  
+        if self.offscreen:
+            self.screen = pygame.Surface(self.coord(self.height, self.width + 3))
+        else:
+            self.screen = pygame.display.set_mode(self.coord(self.height, self.width + 3))  
         self.screen.fill( BG_COLOR )
         self.draw_lines()
+        self.dirty_rects = None
+        self.score_texts = None
         self.load_state(state)
         if self.render:
             self.render()
         
     def render(self):
-        pygame.display.update()
+        """
+        Pushes the cells drawn since the last render to the display
+        """
+        if self.offscreen:
+            pass
+        elif self.dirty_rects is None:
+            pygame.display.update()
+        elif self.dirty_rects:
+            pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
         
     def save(self, path):
         pygame.image.save(self.screen, path)
+        
+    def frame(self):
+        """
+        Returns a copy of the drawn board
+        """
+        return self.screen.copy()
 
     def load_image(self):
-        self.agent_A_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/green_piece.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.cur_agent_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/cur_piece.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.agent_B_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/red_piece.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.wall_A_img =  pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/wall_green.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.wall_B_img =  pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/wall_red.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.background_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/background.jpg'), (626, 986))
-        self.table_img =  pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/board.png'), (512, 512))
-        self.castle_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/castle.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        self.pond_img = pygame.transform.scale(
-            pygame.image.load(self.dir_path + '/images/pond.png'), (self.SQUARE_SIZE, self.SQUARE_SIZE))
-        
-    def load_state(self, state):
+        square = (self.SQUARE_SIZE, self.SQUARE_SIZE)
+        images = self.dir_path + '/images/'
+        self.agent_A_img = get_sprite(images + 'green_piece.png', square)
+        self.cur_agent_img = get_sprite(images + 'cur_piece.png', square)
+        self.agent_B_img = get_sprite(images + 'red_piece.png', square)
+        self.wall_A_img = get_sprite(images + 'wall_green.png', square)
+        self.wall_B_img = get_sprite(images + 'wall_red.png', square)
+        self.background_img = get_sprite(images + 'background.jpg', (626, 986))
+        self.table_img = get_sprite(images + 'board.png', (512, 512))
+        self.castle_img = get_sprite(images + 'castle.png', square)
+        self.pond_img = get_sprite(images + 'pond.png', square)
+        
+    def cell_id(self, layers, i, j):
         # ID 0: Empty
         # ID 1: Wall A
         # ID 2: Wall B
@@ -71,54 +108,54 @@ class Screen():
         # ID 6: Territory B
         # ID 7: Castle
         # ID 8: Pond
+        walls, castles, ponds, agents, territories = layers
+        if walls[0, i, j] == 1:
+            return 1
+        if walls[1, i, j] == 1:
+            return 2
+        if castles[i, j] == 1:
+            return 7
+        if ponds[i, j] == 1:
+            return 8
+        if agents[0, i, j] == 1:
+            return 3
+        if agents[1, i, j] == 1:
+            return 4
+        if territories[0, i, j] == 1:
+            return 5
+        if territories[1, i, j] == 1:
+            return 6
+        return 0
+    
+    def draw_cell(self, i, j, cell_id):
+        if cell_id == 1 or cell_id == 2:
+            self.draw_wall(cell_id - 1, i, j)
+        elif cell_id == 3 or cell_id == 4:
+            self.draw_agent(i, j, cell_id - 3)
+        elif cell_id == 5 or cell_id == 6:
+            self.draw_squares((i, j), cell_id - 5)
+        elif cell_id == 7:
+            self.draw_castle(i, j)
+        elif cell_id == 8:
+            self.draw_pond(i, j)
+        else:
+            self.make_empty_square([i, j])
         
-        for i in range(self.height):
-            for j in range(self.width):
-                # draw wall
-                if state.walls[0, i, j] == 1:
-                    if self.board[i, j] != 1:
-                        self.draw_wall(0, i, j)
-                        self.board[i, j] = 1
-                    continue
-                elif state.walls[1, i, j] == 1:
-                    if self.board[i, j] != 2:
-                        self.draw_wall(1, i, j)
-                        self.board[i, j] = 2
-                    continue
-                if state.castles[i, j] == 1:
-                    if self.board[i, j] != 7:
-                        self.draw_castle(i, j)
-                        self.board[i, j] = 7
-                    continue
-                if state.ponds[i, j] == 1:
-                    if self.board[i, j] != 8:
-                        self.draw_pond(i, j)
-                        self.board[i, j] = 8
-                    continue
-                if state.agents[0, i, j] == 1:
-                    if self.board[i, j] != 3:
-                        self.draw_agent(i, j, 0)
-                        self.board[i, j] = 3
-                    continue
-                elif state.agents[1, i, j] == 1:
-                    if self.board[i, j] != 4:
-                        self.draw_agent(i, j, 1)
-                        self.board[i, j] = 4
-                    continue
-                if state.territories[0, i, j] == 1:
-                    if self.board[i, j] != 5:
-                        self.draw_squares((i, j), 0)
-                        self.board[i, j] = 5
-                    continue
-                elif state.territories[1, i, j] == 1:
-                    if self.board[i, j] != 6:
-                        self.draw_squares((i, j), 1)
-                        self.board[i, j] = 6
-                    continue
-                        
-                if self.board[i][j] != 0:
-                    self.make_empty_square([i, j])
-                    self.board[i, j] = 0
+    def load_state(self, state, cells=None):
+        """
+        Redraws the cells whose content changed, among the given (x, y) cells
+        or all the cells of the board if cells is None
+        """
+        if cells is None:
+            cells = [(i, j) for i in range(self.height) for j in range(self.width)]
+        layers = (state.walls, state.castles, state.ponds, state.agents, state.territories)
+        for i, j in cells:
+            cell_id = self.cell_id(layers, i, j)
+            if self.board[i, j] != cell_id:
+                self.draw_cell(i, j, cell_id)
+                self.board[i, j] = cell_id
+                if self.dirty_rects is not None:
+                    self.dirty_rects.append(pygame.Rect(self.coord(i, j), (self.SQUARE_SIZE, self.SQUARE_SIZE)))
                 
         self.show_score(state)
         
@@ -126,20 +163,28 @@ class Screen():
         return x * self.SQUARE_SIZE, y * self.SQUARE_SIZE
     
     def show_score(self, state):
+        scores = state.scores
+        texts = ("Score: " + str(round(scores[0])), "Score: " + str(round(scores[1])),
+                 "Steps left: " + str(state.remaining_turns))
+        if texts == self.score_texts:
+            return
+        self.score_texts = texts
         # self.screen.blit(self.table_img, self.coord(self.height - 1, -2))
         self.draw_rectangle((0, self.width), (self.height, self.width + 3), BG_COLOR)
+        if self.dirty_rects is not None:
+            x1, y1 = self.coord(0, self.width)
+            x2, y2 = self.coord(self.height, self.width + 3)
+            self.dirty_rects.append(pygame.Rect(x1, y1, x2 - x1, y2 - y1))
         pygame.draw.line(self.screen, LINE_COLOR, self.coord(0, self.width), 
                               self.coord(self.height, self.width),
                               self.LINE_WIDTH )
-        myFont = pygame.font.SysFont("Helvetica", 20)
+        myFont = get_font("Helvetica", 20)
         
         color = LINE_COLOR
         
-        SA = myFont.render("Score: " + str(round(state.scores[0])), 0, color)
-        SB = myFont.render("Score: " + str(round(state.scores[1])), 0, color)
-        
-        myFont = pygame.font.SysFont("Helvetica", 20)
-        STurns = myFont.render("Steps left: " + str(state.remaining_turns), 0, color)
+        SA = myFont.render(texts[0], 0, color)
+        SB = myFont.render(texts[1], 0, color)
+        STurns = myFont.render(texts[2], 0, color)
         
         text_1_coord = self.coord(1, self.width)
         text_2_coord = self.coord(1, self.width + 1)
@@ -151,7 +196,7 @@ class Screen():
         self.screen.blit(STurns, self.coord(0, self.width + 2))
     
     def show_value(self, value, x, y):
-        myFont = pygame.font.SysFont("Times New Roman", 30)
+        myFont = get_font("Times New Roman", 30)
         value = round(value)
         pos = 5
         if value >= 0 and value < 10:
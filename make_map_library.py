@@ -0,0 +1,30 @@
+"""
+Generates random maps and writes them as a MapLibrary,
+a fixed map set for benchmarks and evaluation (see run_episodes.py --map-library).
+"""
+import json
+import logging
+import time
+from argparse import ArgumentParser
+from src.map_library import MapLibrary
+from src.map_pool import MapPool
+log = logging.getLogger(__name__)
+
+def argument_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--output', required=True, help='Directory of the library')
+    parser.add_argument('--size', type=int, default=10000, help='Number of maps')
+    parser.add_argument('--seed', type=int, default=0, help='Map i is drawn from the seed sequence (seed, i)')
+    parser.add_argument('--configs', default='configs/map.json')
+    return parser.parse_args()
+
+def main():
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    args = argument_parser()
+    configs = json.load(open(args.configs))
+    start = time.time()
+    library = MapLibrary.write(args.output, MapPool(configs['map'], size=args.size, seed=args.seed))
+    logging.info('{} maps written to {} in {:.2f}s'.format(len(library), args.output, time.time() - start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Plays many headless games between two brains over a process pool
+and reports win/draw/score statistics, optionally writing the transitions
+to a dataset directory.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import random
+import time
+from argparse import ArgumentParser
+import numpy as np
+from algorithms.RandomStep import RandomStep
+from algorithms.StupidMove import StupidMove
+from src.dataset import DatasetWriter
+from src.environment import AgentFighting
+from src.map_library import MapLibrary
+log = logging.getLogger(__name__)
+
+brains = {
+    'random': RandomStep,
+    'stupid': StupidMove
+}
+
+writers = {} # dataset directory -> DatasetWriter of this process
+
+def argument_parser():
+    parser = ArgumentParser()
+    parser.add_argument('--num-episodes', type=int, default=1000,
+                        help='Number of games to play')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes, 1 plays in this process')
+    parser.add_argument('--batch-size', type=int, default=10,
+                        help='Number of games sent to a worker at once')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the first game, game i uses seed + i')
+    parser.add_argument('--player-1', choices=brains.keys(), default='random')
+    parser.add_argument('--player-2', choices=brains.keys(), default='stupid')
+    parser.add_argument('--engine', choices=AgentFighting.engines.keys(), default='array')
+    parser.add_argument('--configs', default='configs/map.json')
+    parser.add_argument('--map-library', default=None,
+                        help='Directory of a MapLibrary to draw the maps from, see make_map_library.py')
+    parser.add_argument('--dataset', default=None,
+                        help='Directory to write the (observation, valid_actions, action, reward, done) '
+                             'transitions to, see src/dataset.py')
+    return parser.parse_args()
+
+def play_episode(configs, player_names, engine, seed, map_library=None, writer=None):
+    """
+    Plays one game, the random modules are reseeded so that the result depends only on the seed.
+    The transitions are appended to writer if given
+    """
+    random.seed(seed)
+    np.random.seed(seed % 2 ** 32)
+    env = AgentFighting(None, configs, render=False, engine=engine, seed=seed, map_pool=map_library)
+    players = [brains[name](n_actions=env.n_actions, num_agents=env.num_agents) for name in player_names]
+    state = env.get_state()
+    n_steps = 0
+    while not env.is_terminal():
+        action = players[state['player-id']].get_action(state)
+        if writer is not None:
+            observation, valid_actions = state['observation'], state['valid_actions']
+        state, reward, done = env.step(action, lazy=True)
+        if writer is not None:
+            writer.append(observation, valid_actions, action, reward, done)
+        n_steps += 1
+    return seed, env.get_winner(), env.state.scores.tolist(), n_steps
+
+def dataset_writer(path, seed):
+    """
+    Returns the DatasetWriter of this process, named after its pid and the first seed it played
+    """
+    if path not in writers:
+        writers[path] = DatasetWriter(path, name='{}-{}'.format(seed, os.getpid()))
+    return writers[path]
+
+def play_batch(job):
+    configs, player_names, engine, seeds, map_library, dataset = job
+    writer = dataset_writer(dataset, seeds[0]) if dataset else None
+    results = [play_episode(configs, player_names, engine, seed, map_library, writer) for seed in seeds]
+    if writer is not None:
+        writer.flush()
+    return results
+
+def run(configs, player_names, num_episodes, workers=1, batch_size=10, seed=0, engine='array', map_library=None,
+        dataset=None):
+    """
+    Plays num_episodes games and returns the list of (seed, winner, scores, n_steps) sorted by seed.
+    The workers open the memmaps of map_library instead of receiving the maps, and write
+    their own shards of the dataset directory instead of sending back the transitions
+    """
+    seeds = list(range(seed, seed + num_episodes))
+    jobs = [(configs, player_names, engine, seeds[i:i + batch_size], map_library, dataset)
+            for i in range(0, num_episodes, batch_size)]
+    results = []
+    if workers <= 1:
+        for job in jobs:
+            results.extend(play_batch(job))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            for batch in pool.imap_unordered(play_batch, jobs):
+                results.extend(batch)
+    return sorted(results)
+
+def summarize(results, elapsed):
+    winners = np.array([winner for _, winner, _, _ in results])
+    scores = np.array([scores for _, _, scores, _ in results])
+    n_steps = sum(steps for _, _, _, steps in results)
+    return {
+        'games': len(results),
+        'wins': [int((winners == 0).sum()), int((winners == 1).sum())],
+        'draws': int((winners == -1).sum()),
+        'mean-scores': scores.mean(axis=0).tolist(),
+        'std-scores': scores.std(axis=0).tolist(),
+        'games-per-second': len(results) / elapsed,
+        'steps-per-second': n_steps / elapsed,
+    }
+
+def main():
+    args = argument_parser()
+    configs = json.load(open(args.configs))
+    player_names = (args.player_1, args.player_2)
+    start = time.time()
+    results = run(configs, player_names, args.num_episodes, workers=args.workers,
+                  batch_size=args.batch_size, seed=args.seed, engine=args.engine,
+                  map_library=MapLibrary(args.map_library) if args.map_library else None,
+                  dataset=args.dataset)
+    stats = summarize(results, time.time() - start)
+    logging.info('{} vs {}: {} games'.format(args.player_1, args.player_2, stats['games']))
+    logging.info('Wins: {} / {}, draws: {}'.format(stats['wins'][0], stats['wins'][1], stats['draws']))
+    logging.info('Mean scores: {:.2f} / {:.2f}'.format(*stats['mean-scores']))
+    logging.info('{:.2f} games/s, {:.0f} steps/s'.format(stats['games-per-second'], stats['steps-per-second']))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import numpy as np
+from src.map import Map
+from src.state import State
+
+
+class BitboardState(State):
+    """
+    State with the agent, wall, territory, castle and pond layers packed into
+    arbitrary-precision ints, cell (i, j) being bit i * (width + 1) + j.
+    The extra column of every row is always zero, so horizontal shifts never
+    wrap into the neighbouring row.
+
+    agents, walls and territories are still readable as (2, height, width) arrays,
+    rebuilt from the bits on first access after a change. They are read-only
+    snapshots: modify the state through next() only.
+    """
+    def __init__(self, configs, action_space, debug=False):
+        super().__init__(configs, action_space, debug=debug)
+        self.map_configs = configs
+        self.action_offsets = [self.direction_map[direction] for direction in action_space['Move']] + \
+            [self.direction_map[direction] for direction in action_space['Change']]
+        self.n_moves = len(action_space['Move'])
+        self._layer_cache = {}
+
+    def _pack(self, board):
+        padded = np.zeros((self.height, self.width + 1), dtype=np.uint8)
+        padded[:, :self.width] = board != 0
+        return int.from_bytes(np.packbits(padded, bitorder='little').tobytes(), 'little')
+
+    def _unpack(self, bits):
+        n_cells = self.height * (self.width + 1)
+        data = np.frombuffer(bits.to_bytes((n_cells + 7) // 8, 'little'), dtype=np.uint8)
+        board = np.unpackbits(data, count=n_cells, bitorder='little').astype(np.int8)
+        return board.reshape(self.height, self.width + 1)[:, :self.width]
+
+    def _layer(self, name, bits):
+        board = self._layer_cache.get(name)
+        if board is None:
+            board = np.stack([self._unpack(b) for b in bits])
+            board.flags.writeable = False
+            self._layer_cache[name] = board
+        return board
+
+    def _invalidate(self, name):
+        self._layer_cache.pop(name, None)
+        self._layer_cache.pop('padded', None)
+
+    @property
+    def agents(self):
+        return self._layer('agents', self.agent_bits)
+
+    @agents.setter
+    def agents(self, board):
+        self.agent_bits = [self._pack(board[0]), self._pack(board[1])]
+        self._invalidate('agents')
+
+    @property
+    def walls(self):
+        return self._layer('walls', self.wall_bits)
+
+    @walls.setter
+    def walls(self, board):
+        self.wall_bits = [self._pack(board[0]), self._pack(board[1])]
+        self._invalidate('walls')
+
+    @property
+    def territories(self):
+        return self._layer('territories', self.territory_bits)
+
+    @territories.setter
+    def territories(self, board):
+        self.territory_bits = [self._pack(board[0]), self._pack(board[1])]
+        self._invalidate('territories')
+
+    def padded_layers(self):
+        board = self._layer_cache.get('padded')
+        if board is None:
+            pad = self.obs_range - 1
+            board = np.full((8, self.height + 2 * pad, self.width + 2 * pad), -1, dtype=np.int8)
+            inner = board[:, pad:pad + self.height, pad:pad + self.width]
+            inner[0:4:3] = self.agents
+            inner[1:5:3] = self.walls
+            inner[2:6:3] = self.territories
+            inner[6] = self.castles
+            inner[7] = self.ponds
+            self._layer_cache['padded'] = board
+        return board
+
+    def set_layers(self, agents, walls, castles, territories, ponds):
+        self.height, self.width = castles.shape
+        self.stride = self.width + 1
+        self.full_bits = self._pack(np.ones((self.height, self.width)))
+        self.action_shifts = [dx * self.stride + dy for dx, dy in self.action_offsets]
+        border = np.ones((self.height, self.width))
+        border[1:-1, 1:-1] = 0
+        self.border_bits = self._pack(border)
+        Map.set_layers(self, agents, walls, castles, territories, ponds)
+        self.init_agent_index()
+        self.init_blocked_board()
+        self.init_score_engine()
+        self.castle_bits = self._pack(castles)
+        self.pond_bits = self._pack(ponds)
+        self.listed_agent_bits = self.agent_bits[0] | self.agent_bits[1]
+        self.init_zobrist()
+
+    def update_agent_coords_in_order(self):
+        super().update_agent_coords_in_order()
+        self.listed_agent_bits = self.agent_bits[0] | self.agent_bits[1]
+
+    def _save_turn(self):
+        return super()._save_turn(), self.listed_agent_bits
+
+    def _restore_turn(self, turn):
+        turn, self.listed_agent_bits = turn
+        super()._restore_turn(turn)
+
+    def _save_scoring(self):
+        return list(self.territory_bits), list(self.enclosed_bits), self._territories_synced
+
+    def _restore_scoring(self, saved, wall_cells):
+        self.territory_bits, self.enclosed_bits, self._territories_synced = saved
+        self._invalidate('territories')
+
+    def _set_agent(self, player, x, y, value):
+        bit = 1 << (x * self.stride + y)
+        if value:
+            self.agent_bits[player] |= bit
+        else:
+            self.agent_bits[player] &= ~bit
+        self._invalidate('agents')
+
+    def _set_wall(self, player, x, y, value):
+        bit = 1 << (x * self.stride + y)
+        if value:
+            self.wall_bits[player] |= bit
+        else:
+            self.wall_bits[player] &= ~bit
+        self._invalidate('walls')
+
+    def _is_wall(self, player, x, y):
+        return (self.wall_bits[player] >> (x * self.stride + y)) & 1 == 1
+
+    def is_territory(self, player, x, y):
+        return (self.territory_bits[player] >> (x * self.stride + y)) & 1 == 1
+
+    def _watch_territories(self):
+        return list(self.territory_bits)
+
+    def _territory_changes(self, watched):
+        cells = []
+        for player in range(self.num_players):
+            changed = watched[player] ^ self.territory_bits[player]
+            while changed:
+                low = changed & -changed
+                x, y = divmod(low.bit_length() - 1, self.stride)
+                cells.append((player, x, y, 1 if self.territory_bits[player] & low else 0))
+                changed ^= low
+        return cells
+
+    def is_valid_action(self, action, drop_self=False, agent_idx=None):
+        if action >= len(self.action_offsets):
+            return False
+        current_player = self.current_player
+        if agent_idx is None:
+            agent_idx = self.agent_current_idx
+        x, y = self.agent_coords_in_order[current_player][agent_idx]
+        dx, dy = self.action_offsets[action]
+        x, y = x + dx, y + dy
+        if x < 0 or x >= self.height or y < 0 or y >= self.width:
+            return False
+        bit = 1 << (x * self.stride + y)
+        blocked = self.listed_agent_bits | self.castle_bits | self.pond_bits
+        if action < self.n_moves:
+            # agents moved earlier in this turn are in agent_bits but not yet listed
+            blocked |= self.agent_bits[current_player] | self.wall_bits[0] | self.wall_bits[1]
+        elif not drop_self:
+            blocked |= self.wall_bits[current_player]
+        return not blocked & bit
+
+    def valid_action_masks(self, agent_indices=None):
+        """
+        valid_action_masks() of State from the bits: the target of an action is blocked
+        when its bit is set in the blocked cells of the action type, out of the board cells
+        being blocked through ~full_bits
+        """
+        current_player = self.current_player
+        coords = self.agent_coords_in_order[current_player]
+        if agent_indices is not None:
+            coords = [coords[i] for i in np.atleast_1d(agent_indices)]
+        n_moves = self.n_moves
+        n_changes = len(self.action_offsets) - n_moves
+        move_shifts, change_shifts = self.action_shifts[:n_moves], self.action_shifts[n_moves:]
+        changes_drop_self = self.listed_agent_bits | self.castle_bits | self.pond_bits | ~self.full_bits
+        # agents moved earlier in this turn are in agent_bits but not yet listed
+        moves = changes_drop_self | self.agent_bits[current_player] | self.wall_bits[0] | self.wall_bits[1]
+        changes = changes_drop_self | self.wall_bits[current_player]
+        masks = []
+        for x, y in coords:
+            cell = x * self.stride + y
+            mask = [cell + shift >= 0 and not moves >> (cell + shift) & 1 for shift in move_shifts] + \
+                [cell + shift >= 0 and not changes >> (cell + shift) & 1 for shift in change_shifts]
+            if not any(mask):
+                mask[n_moves:] = [cell + shift >= 0 and not changes_drop_self >> (cell + shift) & 1
+                                  for shift in change_shifts]
+            masks.append(mask + [False] * (self.n_actions - n_moves - n_changes))
+        return np.array(masks, dtype=bool).reshape(len(coords), self.n_actions)
+
+    def border_reachable_bits(self, player):
+        """
+        Returns the cells reachable from the border without crossing a wall of the player,
+        grown one step in the four directions at a time until stable
+        """
+        stride = self.stride
+        open_bits = self.full_bits & ~self.wall_bits[player]
+        reachable = self.border_bits & open_bits
+        while True:
+            grown = (reachable | (reachable << 1) | (reachable >> 1) |
+                     (reachable << stride) | (reachable >> stride)) & open_bits
+            if grown == reachable:
+                return reachable
+            reachable = grown
+
+    def _hash_territory_bits(self, player, changed):
+        keys = self.zobrist_keys[4 + player]
+        while changed:
+            low = changed & -changed
+            x, y = divmod(low.bit_length() - 1, self.stride)
+            self.zobrist_hash ^= keys[x][y]
+            changed ^= low
+
+    def border_reachable(self, player):
+        return self._unpack(self.border_reachable_bits(player)) == 1
+
+    def init_score_engine(self):
+        self._dirty_walls = []
+        self.enclosed_bits = [0 for _ in range(self.num_players)]
+        self._territories_synced = False
+
+    def _update_territories(self):
+        """
+        Recomputes the enclosed regions and the territories when walls have changed
+        """
+        if self._dirty_walls or not self._territories_synced:
+            for player in range(self.num_players):
+                self.enclosed_bits[player] = self.full_bits & ~self.wall_bits[player] & \
+                    ~self.border_reachable_bits(player)
+            for player in range(self.num_players):
+                territory = (self.territory_bits[player] & ~self.wall_bits[1 - player]) | \
+                    self.enclosed_bits[player]
+                self._hash_territory_bits(player, territory ^ self.territory_bits[player])
+                self.territory_bits[player] = territory
+            self._invalidate('territories')
+            self._dirty_walls = []
+            self._territories_synced = True
+
+    def update_score(self):
+        """
+        Updates the score of the current player based on current state,
+        the enclosed regions are recomputed only when walls have changed
+        """
+        self._update_territories()
+        for player in range(self.num_players):
+            enclosed = self.enclosed_bits[player]
+            territory_score = self.territory_bits[player].bit_count()
+            self.wall_scores[player] = self.wall_bits[player].bit_count()
+            self.closed_territory_scores[player] = enclosed.bit_count()
+            self.open_territory_scores[player] = territory_score - self.closed_territory_scores[player]
+            self.territory_scores[player] = territory_score
+            self.castle_scores[player] = (enclosed & self.castle_bits).bit_count()
+
+        if self.debug:
+            self.check_scores()
+
+        for player in range(self.num_players):
+            self.players[player].scores = self.scores[player]
+
+    def check_scores(self):
+        """
+        Compares the bitboard scores with get_scores() run on an array-based copy of the state
+        """
+        reference = State(self.map_configs, self.action_space)
+        reference.agent_coords_in_order = [list(coords) for coords in self.agent_coords_in_order]
+        reference.set_layers(self.agents.copy(), self.walls.copy(), self.castles.copy(),
+                             self.territories.copy(), self.ponds.copy())
+        for player in range(self.num_players):
+            wall_score, closed_territory_score, open_territory_score, castle_score = \
+                reference.get_scores(player)
+            assert wall_score == self.wall_scores[player], 'wall score mismatch'
+            assert closed_territory_score == self.closed_territory_scores[player], \
+                'closed territory score mismatch'
+            assert open_territory_score == self.open_territory_scores[player], \
+                'open territory score mismatch'
+            assert castle_score == self.castle_scores[player], 'castle score mismatch'
+        assert np.array_equal(reference.territories, self.territories), 'territory mismatch'
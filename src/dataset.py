@@ -0,0 +1,136 @@
+import glob
+import json
+import os
+import numpy as np
+
+
+class DatasetWriter(object):
+    """
+    Appends (observation, valid_actions, action, reward, done) transitions to shards of
+    shard_size transitions, one preallocated .npy memmap per field, in the narrow dtypes of
+    fields. The manifest-<name>.json of the writer lists its shards and is rewritten by
+    flush(), so a reader sees the transitions up to the last flush. Writers of different
+    names can write to the same directory, e.g. one per worker process, and each process
+    writes its own files, so no array goes through a queue.
+    """
+    fields = {
+        'observation': np.int8, # -1 (out of the board), 0 or 1
+        'valid_actions': np.uint8,
+        'action': np.uint8,
+        'reward': np.float32,
+        'done': np.uint8,
+    }
+
+    def __init__(self, path, name='0', shard_size=65536):
+        self.path = path
+        self.name = str(name)
+        self.shard_size = shard_size
+        self.shapes = None # per-transition shape of the fields, set by the first append()
+        self.shards = [] # [name, number of transitions]
+        self.arrays = None # memmaps of the shard being written
+        os.makedirs(path, exist_ok=True)
+
+    def new_shard(self):
+        self.flush()
+        shard = '{}-{:05d}'.format(self.name, len(self.shards))
+        self.shards.append([shard, 0])
+        self.arrays = {
+            field: np.lib.format.open_memmap(
+                os.path.join(self.path, '{}.{}.npy'.format(shard, field)), mode='w+',
+                dtype=dtype, shape=(self.shard_size,) + self.shapes[field])
+            for field, dtype in self.fields.items()}
+
+    def append(self, observation, valid_actions, action, reward, done):
+        values = {'observation': observation, 'valid_actions': valid_actions,
+                  'action': action, 'reward': reward, 'done': done}
+        if self.shapes is None:
+            self.shapes = {field: np.shape(value) for field, value in values.items()}
+        if self.arrays is None or self.shards[-1][1] == self.shard_size:
+            self.new_shard()
+        row = self.shards[-1][1]
+        for field, value in values.items():
+            self.arrays[field][row] = value
+        self.shards[-1][1] += 1
+
+    def __len__(self):
+        return sum(size for _, size in self.shards)
+
+    def flush(self):
+        """
+        Writes the shard being filled and the manifest
+        """
+        if self.arrays is not None:
+            for array in self.arrays.values():
+                array.flush()
+        manifest = {
+            'shard-size': self.shard_size,
+            'fields': {field: {'dtype': np.dtype(dtype).str, 'shape': list(self.shapes[field])}
+                       for field, dtype in self.fields.items()} if self.shapes else {},
+            'shards': [{'name': shard, 'size': size} for shard, size in self.shards],
+        }
+        path = os.path.join(self.path, 'manifest-{}.json'.format(self.name))
+        with open(path + '.tmp', 'w') as file:
+            json.dump(manifest, file)
+        os.replace(path + '.tmp', path)
+
+    def close(self):
+        self.flush()
+        self.arrays = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DatasetReader(object):
+    """
+    Reads the shards listed by the manifests of a DatasetWriter directory as read-only
+    memmaps, so a mini-batch only reads its own rows from disk.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.shards = [] # (name, number of transitions)
+        for manifest_path in sorted(glob.glob(os.path.join(path, 'manifest-*.json'))):
+            with open(manifest_path) as file:
+                manifest = json.load(file)
+            self.shards.extend((shard['name'], shard['size']) for shard in manifest['shards'] if shard['size'])
+        self.offsets = np.cumsum([0] + [size for _, size in self.shards])
+        self.arrays = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, index):
+        if index not in self.arrays:
+            name = self.shards[index][0]
+            self.arrays[index] = {
+                field: np.load(os.path.join(self.path, '{}.{}.npy'.format(name, field)), mmap_mode='r')
+                for field in DatasetWriter.fields}
+        return self.arrays[index]
+
+    def get(self, indices):
+        """
+        Returns the transitions of the given global indices as a dict of arrays, in sorted order
+        """
+        indices = np.sort(indices)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        parts = {field: [] for field in DatasetWriter.fields}
+        for shard_id in np.unique(shard_ids):
+            rows = indices[shard_ids == shard_id] - self.offsets[shard_id]
+            for field, array in self.shard(shard_id).items():
+                parts[field].append(array[rows])
+        return {field: np.concatenate(arrays) for field, arrays in parts.items()}
+
+    def batches(self, batch_size, rng=None, drop_last=False):
+        """
+        Yields shuffled mini-batches covering every transition once
+        """
+        rng = rng or np.random.default_rng()
+        order = rng.permutation(len(self))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            if drop_last and len(indices) < batch_size:
+                break
+            yield self.get(indices)
@@ -2,17 +2,33 @@ from collections import deque
 from copy import deepcopy as dcopy
 import random
 import numpy as np
-from board.screen import Screen
 from src.player import Player
 from src.state import State
+from src.bitboard import BitboardState
 import logging
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 
 class AgentFighting(object):
-    def __init__(self, args, configs, render = False):
+    engines = {
+        'array': State,
+        'bitboard': BitboardState
+    }
+    
+    def __init__(self, args, configs, render = False, engine = 'array', seed = None, map_pool = None,
+                 recorder = None, game_log = None):
         self.args = args
         self.configs = configs
         self._render = render
+        if seed is None:
+            # from the global numpy state, so that set_seed() still makes the maps reproducible
+            seed = np.random.randint(2 ** 63)
+        self.rng = np.random.default_rng(seed) # draws the maps of this environment
+        self.map_pool = map_pool # a MapPool to draw the maps from instead of generating them
+        self.recorder = recorder # a Recorder that records the games without a display
+        self.game_log = game_log # a GameLog that records the maps and the actions of the games
+        if engine not in self.engines:
+            raise ValueError('Unknown engine: {}'.format(engine))
+        self.engine = engine
         
         self.action_space = {
             'Move': ['U', 'D', 'L', 'R', 'UL', 'UR', 'DL', 'DR'],
@@ -22,19 +38,29 @@ class AgentFighting(object):
         
         self.n_actions = len(self.action_space['Move']) + len(self.action_space['Change']) + 1
         self.num_players = 2
-        self.screen = Screen(render=self._render)
+        self.screen = None
+        if self._render:
+            from board.screen import Screen # pygame is only loaded to render
+            self.screen = Screen(render=True)
         self.players = [Player(i, self.num_players) for i in range(self.num_players)]
         self.current_player = 0
         self.state = None
         self.last_diff_score = 0
         self.s_counter = {}
+        self.dirty_cells = set() # cells changed by the steps played since the last render
         self.reset()
         
-    def render(self, state = None):
+    def render(self, state = None, cells = None):
+        """
+        Draws the state, only the given (x, y) cells and the scores if cells is not None.
+        Without arguments, draws the cells changed by the steps played since the last render
+        """
         if state is None:
             state = self.state
+            if cells is None:
+                cells = self.dirty_cells
         if self._render:
-            self.screen.load_state(state)
+            self.screen.load_state(state, cells)
             self.screen.render()
     
     def save_image(self, path):
@@ -48,14 +74,31 @@ class AgentFighting(object):
         """
         self.players[0].reset_scores()
         self.players[1].reset_scores()
-        self.state = State(self.configs['map'], action_space=self.action_space)
-        self.state.set_players(self.players)
+        self.state = self.new_state(self.players)
         self.num_agents = self.state.num_agents
-        self.state.make_random_map()
+        if self.map_pool is not None:
+            self.map_pool.load(self.state, rng=self.rng)
+        else:
+            self.state.make_random_map(rng=self.rng)
         if self._render:
             self.screen.init(self.state)
+        if self.recorder is not None:
+            self.recorder.new_game(self.state)
+        if self.game_log is not None:
+            self.game_log.start_game(self.state)
+        self.dirty_cells = set()
         self.num_agents = self.state.num_agents
     
+    def new_state(self, players=None):
+        """
+        Returns a state of the engine of the environment, to be given a map with set_map()
+        """
+        state = self.engines[self.engine](self.configs['map'], action_space=self.action_space)
+        if players is None:
+            players = [Player(i, self.num_players) for i in range(self.num_players)]
+        state.set_players(players)
+        return state
+    
     def in_bounds(self, coords):
         return 0 <= coords[0] < self.state.height and 0 <= coords[1] < self.state.width
     
@@ -72,6 +115,13 @@ class AgentFighting(object):
             return self.state.get_state(partial=partial)
         
         
+    def get_all_agent_observations(self):
+        """
+        Returns the observations and valid-action masks of all agents of the current player,
+        see State.get_all_agent_observations()
+        """
+        return self.state.get_all_agent_observations()
+        
     def hash_arr(self, arr: np.ndarray):
         s = ''.join([str(x) for x in arr.flatten()])
         return s
@@ -215,7 +265,7 @@ class AgentFighting(object):
         curr_player_id = self.state.current_player
         return scores[curr_player_id] - scores[1 - curr_player_id]
                     
-    def step(self, action, verbose=False):
+    def step(self, action, verbose=False, lazy=False):
         """
         This function performs a single step of the game by taking an action as input. The action 
         should be valid or else the function returns the reward. If the action is valid, then the 
@@ -223,23 +273,40 @@ class AgentFighting(object):
 
         Args:
             action: The action to be taken in the game.
+            lazy: Returns the next state as a LazyObservation, built only from the fields that are read.
 
         Returns:
             reward: The reward obtained from the step.
         """
         current_player = self.state.current_player
-        previous_scores = self.state.scores
-        diff_previous_scores = previous_scores[current_player] - previous_scores[1 - current_player]
+        diff_previous_scores = self.state.player_score(current_player) - \
+            self.state.player_score(1 - current_player)
         current_agent_idx = self.state.agent_current_idx
         
-        self.state.next(action)
+        draw = self._render or self.recorder is not None
+        if draw:
+            # the agent cell and the cell it moves to or changes the wall of
+            x, y = self.state.agent_coords_in_order[current_player][current_agent_idx]
+            self.dirty_cells.add((x, y))
+            if action < len(self.state.action_offsets):
+                dx, dy = self.state.action_offsets[action]
+                if self.in_bounds((x + dx, y + dy)):
+                    self.dirty_cells.add((x + dx, y + dy))
         
-        if self._render:
+        if self.game_log is not None:
+            self.game_log.record(self.state, action)
+        
+        delta = self.state.next(action, return_delta=True)
+        
+        if draw:
+            self.dirty_cells.update((x, y) for _, x, y, _ in delta.cells)
             if self.state.agent_current_idx == 0:
-                self.render(self.state)
+                self.render(self.state, self.dirty_cells)
+                if self.recorder is not None:
+                    self.recorder.capture(self.state, self.dirty_cells)
+                self.dirty_cells = set()
             
-        new_scores = self.state.scores
-        diff_new_score = new_scores[current_player] - new_scores[1 - current_player]
+        diff_new_score = diff_previous_scores + delta.scores[current_player] - delta.scores[1 - current_player]
         reward = 0.25 if diff_new_score > 0 else -0.5
         
         if diff_new_score > diff_previous_scores:
@@ -251,7 +318,7 @@ class AgentFighting(object):
             
         next_x, next_y = self.state.agent_coords_in_order[current_player][current_agent_idx]
         
-        if self.state.territories[current_player][next_x][next_y] == 1:
+        if self.state.is_territory(current_player, next_x, next_y):
             reward -= 0.25
         else:
             reward += 0.15
@@ -261,5 +328,5 @@ class AgentFighting(object):
             
         self.last_diff_score = diff_new_score
         
-        next_state = self.state.get_state()
+        next_state = self.state.get_state(lazy=lazy)
         return next_state, reward, self.is_terminal()
\ No newline at end of file
@@ -2,6 +2,7 @@ from copy import deepcopy as dcopy
 import random
 import numpy as np
 from uuid import uuid4
+from src.map_library import MapLibrary
 
 
 class Map(object):
@@ -19,6 +20,8 @@ class Map(object):
         self.max_num_agents = configs['max-num-agents']
         self.n_marks = 0
         self.n_turns = 0
+        self.agent_coords_in_order = [[], []]
+        self.agent_current_idx = 0
         
     def update_agent_coords_in_order(self):
         self.agent_coords_in_order = [[], []]
@@ -29,14 +32,53 @@ class Map(object):
                 if self.agents[1][i, j] == 1:
                     self.agent_coords_in_order[1].append((i, j))
     
-    def make_random_map(self):
+    def set_layers(self, agents, walls, castles, territories, ponds):
+        """
+        Sets the boards of the map: agents, walls and territories are (2, height, width),
+        castles and ponds are (height, width)
+        """
+        self.height, self.width = castles.shape
+        self.agents = agents
+        self.walls = walls
+        self.castles = castles
+        self.territories = territories
+        self.ponds = ponds
+    
+    def set_map(self, castles, ponds, agent_coords, n_turns):
+        """
+        Starts a game on the given map: castles and ponds are (height, width) boards,
+        agent_coords the [[(x, y), ...], [(x, y), ...]] cells of the agents of both players
+        in placement order. Walls and territories start empty
+        """
+        height, width = castles.shape
+        agents = np.zeros((2, height, width), dtype=np.int8)
+        self.agent_coords_in_order = [[(int(x), int(y)) for x, y in coords] for coords in agent_coords]
+        for player, coords in enumerate(self.agent_coords_in_order):
+            for x, y in coords:
+                agents[player, x, y] = 1
+        self.n_turns = int(n_turns)
+        self.remaining_turns = self.n_turns
+        self.agent_current_idx = 0
+        self.num_agents = len(self.agent_coords_in_order[0])
+        self.set_layers(agents, np.zeros((2, height, width), dtype=np.int8), castles,
+                        np.zeros((2, height, width), dtype=np.int8), ponds)
+    
+    def make_random_map(self, rng=None):
+        """
+        Starts a game on a random map within the limits of the configs.
+        With a numpy Generator all the objects are placed at once from one draw of distinct
+        free cells, otherwise they are placed one by one with the random module
+        """
+        if rng is not None:
+            self.make_random_map_vectorized(rng)
+            return
         self.height = random.randint(self.height_min, self.height_max)
         self.width = random.randint(self.width_min, self.width_max)
-        self.agents = np.zeros((2, self.height, self.width), dtype=np.int8)
-        self.walls = np.zeros((2, self.height, self.width), dtype=np.int8)
-        self.castles = np.zeros((self.height, self.width), dtype=np.int8)
-        self.territories = np.zeros((2, self.height, self.width), dtype=np.int8)
-        self.ponds = np.zeros((self.height, self.width), dtype=np.int8)
+        agents = np.zeros((2, self.height, self.width), dtype=np.int8)
+        walls = np.zeros((2, self.height, self.width), dtype=np.int8)
+        castles = np.zeros((self.height, self.width), dtype=np.int8)
+        territories = np.zeros((2, self.height, self.width), dtype=np.int8)
+        ponds = np.zeros((self.height, self.width), dtype=np.int8)
         self.n_turns = random.randint(self.min_num_turns, self.max_num_turns)
         self.remaining_turns = self.n_turns
         self.agent_coords_in_order = [[], []]
@@ -51,60 +93,78 @@ class Map(object):
         for i in range(self.num_castles):
             # generate random from slots
             (x, y) = random.choice(list(slots.keys()))
-            self.castles[x, y] = 1
+            castles[x, y] = 1
             del slots[(x, y)]
         
         # generate random symmetric castle coords in range of self
         for i in range(self.num_ponds):
             # generate random from slots
             (x, y) = random.choice(list(slots.keys()))
-            self.ponds[x, y] = 1
+            ponds[x, y] = 1
             del slots[(x, y)]
             
         #generate random symmetric agents positions in range of self
         self.num_agents = random.randint(self.min_num_agents, self.max_num_agents)
         for i in range(self.num_agents):
             (x, y) = random.choice(list(slots.keys()))
-            self.agents[0, x, y] = 1
+            agents[0, x, y] = 1
             self.agent_coords_in_order[0].append((x, y))
             del slots[(x, y)]
             (x, y) = random.choice(list(slots.keys()))
-            self.agents[1, x, y] = 1
+            agents[1, x, y] = 1
             self.agent_coords_in_order[1].append((x, y))
             del slots[(x, y)]
         
+        self.set_layers(agents, walls, castles, territories, ponds)
+    
+    def make_random_map_vectorized(self, rng):
+        height = int(rng.integers(self.height_min, self.height_max + 1))
+        width = int(rng.integers(self.width_min, self.width_max + 1))
+        n_turns = int(rng.integers(self.min_num_turns, self.max_num_turns + 1))
+        num_agents = int(rng.integers(self.min_num_agents, self.max_num_agents + 1))
+        # the center cell of maps with odd sides is never used, as in the slots above
+        free = np.arange(height * width)
+        if height % 2 == 1 and width % 2 == 1:
+            free = np.delete(free, height // 2 * width + width // 2)
+        cells = rng.choice(free, size=self.num_castles + self.num_ponds + 2 * num_agents, replace=False)
+        castles = np.zeros(height * width, dtype=np.int8)
+        castles[cells[:self.num_castles]] = 1
+        ponds = np.zeros(height * width, dtype=np.int8)
+        ponds[cells[self.num_castles:self.num_castles + self.num_ponds]] = 1
+        # agents alternate between the players as above
+        agent_cells = cells[self.num_castles + self.num_ponds:].reshape(num_agents, 2).T
+        agent_coords = [list(zip(*np.divmod(agent_cells[player], width))) for player in range(2)]
+        self.height, self.width = height, width
+        self.set_map(castles.reshape(height, width), ponds.reshape(height, width), agent_coords, n_turns)
     
     def get_agent_position(self, player_id, agent_id):
         return self.agent_pos[player_id][agent_id]
     
-    def load(self, castles, wall_pos, agent_pos):
-        self.castles = castles
-        self.wall_pos = wall_pos
-        self.agent_pos = agent_pos
-        self.n_agents = len(agent_pos)
-        for x, y in castles:
-            self.castle_board[x, y] = castles[(x, y)]
-        for x, y in wall_pos:
-            self.wall_board[x, y] = 1
-        for x, y in agent_pos[0]:
-            self.conquered_board[0][x, y] = 1
-        for x, y in agent_pos[1]:
-            self.conquered_board[1][x, y] = 1
+    def load(self, library, index=0):
+        """
+        Starts a game on map index of a MapLibrary, given as an object or a path
+        """
+        if not isinstance(library, MapLibrary):
+            library = MapLibrary(library)
+        library.load(self, index)
+    
+    def save(self, path):
+        """
+        Writes the map as a MapLibrary of one map: castles, ponds, the agents where they are now
+        and the number of turns of the game
+        """
+        return MapLibrary.write(path, [(self.castles, self.ponds, self.agent_coords_in_order, self.n_turns)])
             
     def show_map(self):
+        """
+        Prints the map: castles T, ponds P, walls of the players W and w, agents A and B
+        """
         print('-' * self.width * 4 + '\n')
-        print(self.wall_board)
-        print('\n' + '-' * self.width * 4 + '\n')
         _board = np.zeros((self.height, self.width), dtype=str)
         _board.fill(' ')
-        for coord in self.castles:
-            _board[coord[0], coord[1]] = 'T'
-        for coord in self.wall_pos:
-            _board[coord[0], coord[1]] = 'W'
-        for coord in self.agent_pos[0]:
-            _board[coord[0], coord[1]] = 'A'
-        for coord in self.agent_pos[1]:
-            _board[coord[0], coord[1]] = 'B'
+        for symbol, layer in (('T', self.castles), ('P', self.ponds), ('W', self.walls[0]), ('w', self.walls[1]),
+                              ('A', self.agents[0]), ('B', self.agents[1])):
+            _board[layer == 1] = symbol
                 
         print(np.array2string(_board, separator=' '))
         print('\n' + '-' * self.width * 4)
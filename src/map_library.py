@@ -0,0 +1,98 @@
+import os
+import numpy as np
+
+
+class MapLibrary(object):
+    """
+    Fixed set of maps stored in a directory as two .npy files, opened as read-only memmaps:
+    cells.npy holds the cells of all the maps one after the other, one uint8 code per cell
+    (0 empty, 1 castle, 2 pond, 3 + 2 * i + player the i-th agent of the player),
+    index.npy the offset, size, number of turns and number of agents of every map.
+    Maps are read on access from the page cache, which is shared by the processes that open
+    the same library, and a pickled library only carries its path.
+    Same interface as MapPool, so it can be given to AgentFighting(map_pool=...).
+    """
+    EMPTY, CASTLE, POND, AGENT = 0, 1, 2, 3
+    index_dtype = np.dtype([('offset', '<i8'), ('height', '<i2'), ('width', '<i2'),
+                            ('n_turns', '<i2'), ('num_agents', '<i1')])
+
+    def __init__(self, path):
+        self.path = path
+        self.cells = np.load(os.path.join(path, 'cells.npy'), mmap_mode='r')
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+
+    @classmethod
+    def encode(cls, castles, ponds, agent_coords):
+        cells = np.zeros(castles.shape, dtype=np.uint8)
+        cells[castles == 1] = cls.CASTLE
+        cells[ponds == 1] = cls.POND
+        for player, coords in enumerate(agent_coords):
+            for i, (x, y) in enumerate(coords):
+                cells[x, y] = cls.AGENT + 2 * i + player
+        return cells.ravel()
+
+    @classmethod
+    def decode(cls, cells, n_turns):
+        """
+        Returns the (castles, ponds, agent_coords, n_turns) arguments of Map.set_map()
+        for the (height, width) cell codes of a map
+        """
+        castles = (cells == cls.CASTLE).astype(np.int8)
+        ponds = (cells == cls.POND).astype(np.int8)
+        xs, ys = np.nonzero(cells >= cls.AGENT)
+        codes = cells[xs, ys].astype(np.int64) - cls.AGENT
+        agent_coords = [[], []]
+        for code, x, y in sorted(zip(codes.tolist(), xs.tolist(), ys.tolist())):
+            agent_coords[code % 2].append((x, y))
+        return castles, ponds, agent_coords, int(n_turns)
+
+    @classmethod
+    def write(cls, path, maps):
+        """
+        Writes the (castles, ponds, agent_coords, n_turns) maps, e.g. a MapPool, as a library
+        """
+        os.makedirs(path, exist_ok=True)
+        encoded = []
+        index = []
+        offset = 0
+        for castles, ponds, agent_coords, n_turns in maps:
+            height, width = castles.shape
+            encoded.append(cls.encode(castles, ponds, agent_coords))
+            index.append((offset, height, width, n_turns, len(agent_coords[0])))
+            offset += height * width
+        np.save(os.path.join(path, 'cells.npy'),
+                np.concatenate(encoded) if encoded else np.zeros(0, dtype=np.uint8))
+        np.save(os.path.join(path, 'index.npy'), np.array(index, dtype=cls.index_dtype))
+        return cls(path)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def __len__(self):
+        return len(self.index)
+
+    def map_cells(self, index):
+        """
+        Returns the (height, width) cell codes of a map, a view of the memmap
+        """
+        entry = self.index[index]
+        offset, height, width = int(entry['offset']), int(entry['height']), int(entry['width'])
+        return self.cells[offset:offset + height * width].reshape(height, width)
+
+    def __getitem__(self, index):
+        """
+        Returns the (castles, ponds, agent_coords, n_turns) arguments of Map.set_map()
+        """
+        return self.decode(self.map_cells(index), self.index[index]['n_turns'])
+
+    def load(self, board, index=None, rng=None):
+        """
+        Starts a game on map index of the library, a random one drawn with rng if index is None
+        """
+        if index is None:
+            index = int((rng or np.random.default_rng()).integers(len(self)))
+        board.set_map(*self[index])
+        return index
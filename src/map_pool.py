@@ -0,0 +1,39 @@
+import numpy as np
+from src.map import Map
+
+
+class MapPool(object):
+    """
+    Random maps generated once and reused by AgentFighting.reset(), which then only copies
+    the boards. Map i is drawn by Map.make_random_map() from the seed sequence (seed, i),
+    so a pool is the same for the same configs, size and seed.
+    """
+    def __init__(self, configs, size=1000, seed=0):
+        self.configs = configs
+        self.seed = seed
+        self.maps = [self.generate(index) for index in range(size)]
+
+    def generate(self, index):
+        board = Map(self.configs)
+        board.make_random_map(rng=np.random.default_rng([self.seed, index]))
+        for layer in (board.castles, board.ponds):
+            layer.flags.writeable = False
+        return board.castles, board.ponds, board.agent_coords_in_order, board.n_turns
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __getitem__(self, index):
+        """
+        Returns the (castles, ponds, agent_coords, n_turns) arguments of Map.set_map()
+        """
+        return self.maps[index]
+
+    def load(self, board, index=None, rng=None):
+        """
+        Starts a game on map index of the pool, a random one drawn with rng if index is None
+        """
+        if index is None:
+            index = int((rng or np.random.default_rng()).integers(len(self.maps)))
+        board.set_map(*self.maps[index])
+        return index
@@ -0,0 +1,65 @@
+from collections.abc import MutableMapping
+
+_NOT_LOADED = object()
+
+
+class LazyObservation(MutableMapping):
+    """
+    The dict of State.get_state() with the observation tensor and the valid-action mask
+    computed on first access and cached. Both are taken from the state as it is when they
+    are read, so they must be read before the state changes, which is checked against the
+    state hash. Copying or pickling gives a plain dict with every field loaded.
+    """
+    lazy_keys = ('observation', 'valid_actions')
+
+    def __init__(self, state, partial=True):
+        self.state = state
+        self.partial = partial
+        self.position = (state.zobrist_hash, state.remaining_turns)
+        current_agent_idx = state.agent_current_idx
+        self.fields = {
+            'player-id': state.current_player,
+            'observation': _NOT_LOADED,
+            'current-agent-id': current_agent_idx,
+            'curr_agent_xy': state.agent_coords_in_order[state.current_player][current_agent_idx],
+            'valid_actions': _NOT_LOADED,
+            'remaning_turns': state.remaining_turns,
+            'hash_str': state.string_representation(),
+        }
+
+    def load(self, key):
+        if (self.state.zobrist_hash, self.state.remaining_turns) != self.position:
+            raise RuntimeError('The state has changed since the observation was taken, '
+                               'read {} before playing the next action'.format(key))
+        if key == 'observation':
+            return self.state.get_observation(partial=self.partial)
+        return self.state.valid_action_mask()
+
+    def __getitem__(self, key):
+        value = self.fields[key]
+        if value is _NOT_LOADED:
+            value = self.fields[key] = self.load(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.fields[key] = value
+
+    def __delitem__(self, key):
+        del self.fields[key]
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return 'LazyObservation({})'.format(', '.join(
+            '{}={}'.format(key, 'not loaded' if value is _NOT_LOADED else repr(value))
+            for key, value in self.fields.items()))
+
+    def to_dict(self):
+        return {key: self[key] for key in self.fields}
+
+    def __reduce__(self):
+        return dict, (self.to_dict(),)
@@ -0,0 +1,122 @@
+import logging
+import os
+import queue
+import threading
+import zipfile
+import numpy as np
+import pygame
+from board.screen import Screen
+
+_STOP = object()
+_END_GAME = object()
+
+
+class Recorder(object):
+    """
+    Records the games played by AgentFighting(recorder=...) without a display: the board is
+    drawn on an off-screen Screen at the end of every turn of a player, and the frames are
+    converted and encoded by a background thread, as animated GIFs if path ends with .gif (needs Pillow),
+    else as a frame archive, an .npz of (height, width, 3) uint8 arrays written as they come.
+    A GIF holds the frames until it is saved, so every game is saved as soon as it ends to its
+    own file, games_0000.gif, games_0001.gif... for path games.gif, split in parts of at most
+    max_frames frames.
+    The frames wait for the writer in a queue, and are dropped, before being copied, while
+    queue_size frames are waiting so that step() never waits for the encoder. The last frame
+    of a game is always kept, it is queued past queue_size.
+    """
+    def __init__(self, path, fps=10, queue_size=64, max_frames=512):
+        self.path = path
+        self.fps = fps
+        self.max_frames = max_frames
+        self.gif = path.lower().endswith('.gif')
+        if self.gif:
+            try:
+                from PIL import Image
+            except ImportError:
+                raise ImportError('Recording a GIF needs Pillow, pip install Pillow '
+                                  'or record a frame archive (.npz)')
+            self.image = Image
+            self.images = [] # frames of the GIF being recorded
+            self.n_gifs = 0 # GIFs written
+        else:
+            self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1)
+        self.screen = Screen(render=True, offscreen=True)
+        self.queue_size = queue_size
+        self.frames = queue.Queue() # never full, the frames are dropped at queue_size by capture()
+        self.n_frames = 0 # frames written
+        self.dropped = 0 # frames dropped because the writer was behind
+        self.writer = threading.Thread(target=self.write_frames, daemon=True)
+        self.writer.start()
+
+    def new_game(self, state):
+        self.frames.put_nowait(_END_GAME) # the previous game may not have been played to the end
+        self.screen.init(state)
+        self.capture(state)
+
+    def capture(self, state, cells=None):
+        """
+        Draws the given (x, y) cells, all the cells if None, and queues the frame
+        """
+        self.screen.load_state(state, cells)
+        self.screen.render()
+        if state.is_terminal():
+            self.frames.put_nowait(self.screen.frame())
+            self.frames.put_nowait(_END_GAME)
+        elif self.frames.qsize() >= self.queue_size:
+            self.dropped += 1
+        else:
+            self.frames.put_nowait(self.screen.frame())
+
+    def write_frames(self):
+        while True:
+            frame = self.frames.get()
+            if frame is _STOP or frame is _END_GAME:
+                if self.gif:
+                    self.write_gif()
+                if frame is _STOP:
+                    break
+                continue
+            pixels = pygame.image.tobytes(frame, 'RGB')
+            width, height = frame.get_size()
+            if self.gif:
+                image = self.image.frombytes('RGB', (width, height), pixels)
+                self.images.append(image.quantize(colors=64))
+                if len(self.images) >= self.max_frames:
+                    self.write_gif()
+            else:
+                with self.archive.open('frame_{:06d}.npy'.format(self.n_frames), 'w') as file:
+                    np.lib.format.write_array(
+                        file, np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3))
+            self.n_frames += 1
+
+    def gif_path(self, n):
+        root, ext = os.path.splitext(self.path)
+        return '{}_{:04d}{}'.format(root, n, ext)
+
+    def write_gif(self):
+        if not self.images:
+            return
+        self.images[0].save(self.gif_path(self.n_gifs), save_all=True, append_images=self.images[1:],
+                            duration=int(1000 / self.fps), loop=0)
+        self.images = []
+        self.n_gifs += 1
+
+    def close(self):
+        """
+        Writes the frames still queued and finishes the file
+        """
+        if self.writer is None:
+            return
+        self.frames.put(_STOP)
+        self.writer.join()
+        self.writer = None
+        if not self.gif:
+            self.archive.close()
+        if self.dropped:
+            logging.info('Recorder: {} frames written, {} dropped'.format(self.n_frames, self.dropped))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,138 @@
+import numpy as np
+from src.map_library import MapLibrary
+
+
+class GameLog(object):
+    """
+    Games recorded as their initial map, packed one uint8 per cell as in MapLibrary, and one
+    uint8 per step packing the action (bits 0-3), the index of the agent (bits 4-6) and the
+    player (bit 7) that played it. Recorded by AgentFighting(game_log=...), saved to and
+    loaded from one compressed .npz.
+    """
+    game_dtype = np.dtype(MapLibrary.index_dtype.descr + [('step_offset', '<i8'), ('n_steps', '<i4')])
+
+    def __init__(self):
+        self.maps = [] # (height * width cell codes, height, width, n_turns, num_agents)
+        self.steps = [] # packed steps of every game, a bytearray while it is recorded
+
+    @staticmethod
+    def pack(action, agent_idx, player):
+        return action | agent_idx << 4 | player << 7
+
+    @staticmethod
+    def unpack(step):
+        """
+        Returns the (action, agent index, player) of a packed step
+        """
+        return step & 15, step >> 4 & 7, step >> 7
+
+    def start_game(self, state):
+        """
+        Starts recording a game on the map of the state, which has not been played yet
+        """
+        cells = MapLibrary.encode(state.castles, state.ponds, state.agent_coords_in_order)
+        self.maps.append((cells, state.height, state.width, state.n_turns, state.num_agents))
+        self.steps.append(bytearray())
+
+    def record(self, state, action):
+        """
+        Records the action the current agent of the state is about to play
+        """
+        self.steps[-1].append(self.pack(action, state.agent_current_idx, state.current_player))
+
+    def __len__(self):
+        return len(self.maps)
+
+    def game_map(self, game):
+        """
+        Returns the (castles, ponds, agent_coords, n_turns) arguments of Map.set_map()
+        """
+        cells, height, width, n_turns, _ = self.maps[game]
+        return MapLibrary.decode(np.asarray(cells).reshape(height, width), n_turns)
+
+    def game_steps(self, game):
+        return np.frombuffer(self.steps[game], dtype=np.uint8)
+
+    def replay(self, game, state, interval=32):
+        """
+        Returns a Replay of the game, state being a new state of the engine to replay it with,
+        e.g. AgentFighting.new_state()
+        """
+        state.set_map(*self.game_map(game))
+        return Replay(state, self.game_steps(game), interval)
+
+    def save(self, path):
+        games = np.zeros(len(self), dtype=self.game_dtype)
+        offset, step_offset = 0, 0
+        for game, ((cells, height, width, n_turns, num_agents), steps) in enumerate(zip(self.maps, self.steps)):
+            games[game] = (offset, height, width, n_turns, num_agents, step_offset, len(steps))
+            offset += len(cells)
+            step_offset += len(steps)
+        cells = [cells for cells, *_ in self.maps]
+        np.savez_compressed(
+            path, games=games, cells=np.concatenate(cells) if cells else np.zeros(0, dtype=np.uint8),
+            steps=np.frombuffer(b''.join(bytes(steps) for steps in self.steps), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a saved log, the maps and the steps of the games are views of two arrays
+        """
+        log = cls()
+        with np.load(path) as data:
+            games, cells, steps = data['games'], data['cells'], data['steps']
+        for game in games:
+            offset, height, width = int(game['offset']), int(game['height']), int(game['width'])
+            log.maps.append((cells[offset:offset + height * width], height, width,
+                             int(game['n_turns']), int(game['num_agents'])))
+            step_offset = int(game['step_offset'])
+            log.steps.append(steps[step_offset:step_offset + int(game['n_steps'])])
+        return log
+
+
+class Replay(object):
+    """
+    Rebuilds the states of a recorded game. The state is copied every interval steps the
+    first time they are replayed, so any later state_at() replays at most interval actions
+    from the closest checkpoint.
+    """
+    def __init__(self, state, steps, interval=32):
+        self.steps = steps
+        self.interval = interval
+        self.checkpoints = [state.copy()] # state before step i * interval
+
+    def __len__(self):
+        return len(self.steps)
+
+    def play(self, state, step):
+        action, agent_idx, player = GameLog.unpack(int(self.steps[step]))
+        if state.current_player != player or state.agent_current_idx != agent_idx:
+            raise ValueError('Step {} of the replay was played by agent {} of player {}, '
+                             'not the current agent of the state'.format(step, agent_idx, player))
+        state.next(action)
+
+    def state_at(self, step):
+        """
+        Returns a new state, as it was before the given step, or at the end of the game
+        for step == len(self)
+        """
+        if not 0 <= step <= len(self.steps):
+            raise IndexError('step {} out of range [0, {}]'.format(step, len(self.steps)))
+        checkpoint = min(step // self.interval, len(self.checkpoints) - 1)
+        state = self.checkpoints[checkpoint].copy()
+        for i in range(checkpoint * self.interval, step):
+            self.play(state, i)
+            if (i + 1) % self.interval == 0 and (i + 1) // self.interval == len(self.checkpoints):
+                self.checkpoints.append(state.copy())
+        return state
+
+    def states(self):
+        """
+        Yields (step, state) from the start to the end of the game, the same state object
+        played forward
+        """
+        state = self.checkpoints[0].copy()
+        for step in range(len(self.steps)):
+            yield step, state
+            self.play(state, step)
+        yield len(self.steps), state
@@ -1,12 +1,54 @@
 
+from collections import namedtuple
 import numpy as np
 from src.map import Map
+from src.observation import LazyObservation
 from copy import deepcopy as dcopy
 
+
+ScoreDelta = namedtuple('ScoreDelta', ['valid', 'walls', 'castles', 'open_territories',
+                                       'closed_territories', 'scores', 'cells'])
+ScoreDelta.__doc__ = """
+Changes made by one State.next(): whether the action was valid, the per-player differences
+of the score components and of the total scores, and the territory cells that changed
+as (player, x, y, new value)
+"""
+
+
+class Undo(object):
+    """
+    What push() needs to take an action back: the moved agent (player, from, to),
+    the toggled walls (player, x, y, old value), the scoring state saved before
+    update_score(), the score components, the turn counters and the hash
+    """
+    __slots__ = ('agent', 'walls', 'scoring', 'scores', 'current_player', 'agent_current_idx',
+                 'remaining_turns', 'turn', 'zobrist_hash')
+    
+    def __init__(self, state):
+        self.agent = None
+        self.walls = []
+        self.scoring = None
+        self.scores = (list(state.wall_scores), list(state.castle_scores), list(state.open_territory_scores),
+                       list(state.closed_territory_scores), list(state.territory_scores))
+        self.current_player = state.current_player
+        self.agent_current_idx = state.agent_current_idx
+        self.remaining_turns = state.remaining_turns
+        self.turn = state._save_turn()
+        self.zobrist_hash = state.zobrist_hash
+
+
 class State(Map):
-    def __init__(self, configs, action_space):
+    scoring_backends = ('incremental', 'python', 'vectorized')
+    zobrist_tables = {} # (height, width) -> key tables, shared by all states
+    
+    def __init__(self, configs, action_space, debug=False, scoring='incremental'):
         super().__init__(configs)
+        if scoring not in self.scoring_backends:
+            raise ValueError('Unknown scoring backend: {}'.format(scoring))
         self.action_space = action_space
+        self.scoring = scoring # 'incremental', 'python' (get_scores) or 'vectorized' (get_scores_vectorized)
+        self.debug = debug # cross-check incremental results against full recomputation
+        self.rollout_mode = False # see set_rollout_mode()
         self.num_players = 2
         self.current_player = 0
         self.num_agents = None
@@ -48,20 +90,129 @@ class State(Map):
         }
         
         self.n_actions = len(self.action_map.values())
+        self.n_moves = len(action_space['Move'])
+        self._undo = None # entry being recorded by push()
+        self._undo_stack = []
+        self._territory_journal = None
+        self.action_offsets = np.array([self.direction_map[direction] for direction in action_space['Move']] +
+                                       [self.direction_map[direction] for direction in action_space['Change']])
+        self._dirty_walls = []
+        
+    def set_layers(self, agents, walls, castles, territories, ponds):
+        """
+        Copies the boards into padded_board, an (8, height + 2 * (obs_range - 1), width + 2 * (obs_range - 1))
+        array in the layer order of get_state() for player 0, padded with -1.
+        agents, walls, territories, castles and ponds are views of its inner part,
+        so the partial observations are cut from it without rebuilding the layers
+        """
+        pad = self.obs_range - 1
+        height, width = castles.shape
+        self.padded_board = np.full((8, height + 2 * pad, width + 2 * pad), -1, dtype=np.int8)
+        self._bind_layers(height, width)
+        self.agents[:] = agents
+        self.walls[:] = walls
+        self.castles[:] = castles
+        self.territories[:] = territories
+        self.ponds[:] = ponds
+        self.init_agent_index()
+        self.init_blocked_board()
+        self.init_score_engine()
+        self.init_zobrist()
+        
+    def _bind_layers(self, height, width):
+        pad = self.obs_range - 1
+        inner = self.padded_board[:, pad:pad + height, pad:pad + width]
+        super().set_layers(inner[0:4:3], inner[1:5:3], inner[6], inner[2:6:3], inner[7])
+    
+    def padded_layers(self):
+        return self.padded_board
+        
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if 'padded_board' in state:
+            # views are rebuilt by __setstate__, copying them would detach them from padded_board
+            for name in ('agents', 'walls', 'castles', 'territories', 'ponds'):
+                del state[name]
+        if 'zobrist_keys' in state:
+            # the key tables are shared, __setstate__ takes them back from zobrist_tables
+            for name in ('zobrist_keys', 'zobrist_turn_keys', 'zobrist_listed_keys'):
+                del state[name]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'padded_board' in state:
+            self._bind_layers(self.height, self.width)
+        if 'zobrist_hash' in state:
+            self.bind_zobrist_tables()
         
     def hash_arr(self, arr: np.ndarray):
         s = ''.join([str(x) for x in arr.flatten()])
         return s
         
     
+    def init_zobrist(self):
+        """
+        Draws the Zobrist key table of the map: one 64-bit key per cell of the agent, wall and
+        territory layers of both players (layers 0-1, 2-3 and 4-5), castles and ponds (6 and 7),
+        one key per (player, agent) to move, and one key per cell for the agents of the player
+        to move as listed in agent_coords_in_order, which block cells until its turn ends.
+        The keys only depend on the map size, so hashes are reproducible. Then computes the
+        hash of the current state
+        """
+        self.bind_zobrist_tables()
+        self.zobrist_listed = self.listed_zobrist()
+        self.zobrist_hash = self.compute_zobrist()
+    
+    def bind_zobrist_tables(self):
+        """
+        Binds the key tables of the map size, drawn on first use and shared by all the states
+        """
+        table_key = (self.height, self.width)
+        if table_key not in self.zobrist_tables:
+            rng = np.random.default_rng([self.height, self.width])
+            # a map has at most one agent per cell
+            self.zobrist_tables[table_key] = (
+                rng.integers(0, 2 ** 64, size=(8, self.height, self.width), dtype=np.uint64).tolist(),
+                rng.integers(0, 2 ** 64, size=(self.num_players, self.height * self.width),
+                             dtype=np.uint64).tolist(),
+                rng.integers(0, 2 ** 64, size=(self.height, self.width), dtype=np.uint64).tolist())
+        self.zobrist_keys, self.zobrist_turn_keys, self.zobrist_listed_keys = self.zobrist_tables[table_key]
+    
+    def listed_zobrist(self):
+        """
+        Hash term of the agents of the player to move as listed at the start of its turn
+        """
+        keys = self.zobrist_listed_keys
+        h = 0
+        for x, y in self.agent_coords_in_order[self.current_player]:
+            h ^= keys[x][y]
+        return h
+    
+    def compute_zobrist(self):
+        """
+        Computes the Zobrist hash of the state from scratch
+        """
+        layers = (self.agents[0], self.agents[1], self.walls[0], self.walls[1],
+                  self.territories[0], self.territories[1], self.castles, self.ponds)
+        h = self.zobrist_turn_keys[self.current_player][self.agent_current_idx] ^ self.listed_zobrist()
+        for layer, board in enumerate(layers):
+            for x, y in zip(*np.nonzero(board == 1)):
+                h ^= self.zobrist_keys[layer][x][y]
+        return h
+    
+    def _hash_territory_changes(self, territories):
+        """
+        Folds into the hash the territory cells that differ from the given (2, height, width) board
+        """
+        for player, x, y in zip(*np.nonzero(territories != self.territories)):
+            self.zobrist_hash ^= self.zobrist_keys[4 + player][x][y]
+    
     def string_representation(self):
         """
-        Returns a hash code for string representation of the state
+        Returns a hash code of the state, the Zobrist hash maintained by next()
         """
-        players = [self.current_player, self.current_player ^ 1]
-        s = self.hash_arr(self.agents[players]) + self.hash_arr(self.walls[players]) + \
-            self.hash_arr(self.castles) + self.hash_arr(self.territories[players])
-        return hash(s)    
+        return self.zobrist_hash
     
     def current_position(self):
         return self.agent_coords_in_order[self.current_player][self.agent_current_idx]
@@ -85,6 +236,13 @@ class State(Map):
         return np.array([score_A, score_B])
     
     
+    def player_score(self, player):
+        """
+        Score of one player, as scores[player] without building the array
+        """
+        return self.alpha * self.wall_scores[player] + self.beta * self.castle_scores[player] + \
+            self.gamma * (self.open_territory_scores[player] + self.closed_territory_scores[player])
+    
     def set_players(self, players):
         self.players = players
     
@@ -92,8 +250,16 @@ class State(Map):
         return self.agent_pos[self.current_player]
     
     def to_opponent(self):
+        """
+        Returns a copy of the state with the opponent to move, hashed as such
+        """
         state = dcopy(self)
+        state.zobrist_hash ^= state.zobrist_turn_keys[state.current_player][state.agent_current_idx] ^ \
+            state.zobrist_listed
         state.current_player ^= 1
+        state.zobrist_listed = state.listed_zobrist()
+        state.zobrist_hash ^= state.zobrist_turn_keys[state.current_player][state.agent_current_idx] ^ \
+            state.zobrist_listed
         return state
 
     def transition_matrix(self, matrix, vector):
@@ -117,7 +283,7 @@ class State(Map):
     def terminal(self):
         return self.remaining_turns == 0
     
-    def get_state(self, partial=True):
+    def get_state(self, partial=True, lazy=False):
         """
         partial = True (default) if you want to get the partial state,
         the environment will return the a matrix of size (self.obs_range x 2 + 1) x (self.obs_range x 2 + 1) 
@@ -136,66 +302,183 @@ class State(Map):
         see function get_state() in src/state.py
         Using env.get_state(partial=False) if you want to get the full state,
         the full state is a matrix of size height x width (observation_shape)
+        lazy = True returns a LazyObservation computing the observation and the valid actions
+        on first access
         """
-        # Standardized variable names to improve readability
-        players = [self.current_player, self.current_player ^ 1]
-        agent_board = self.agents[players]
-        castle_board = self.castles
-        pond_board = self.ponds
-        wall_board = self.walls[players]
-        territory_board = self.territories[players]
-        agent_current_board = np.zeros(agent_board[0].shape)
-        obs = np.stack(
-            (
-                agent_board[0], 
-                wall_board[0], 
-                territory_board[0], 
-                agent_board[1],
-                wall_board[1],
-                territory_board[1],
-                castle_board,
-                pond_board
-            ),
-            axis=0
-        )
-        
-        
-        
+        if lazy:
+            return LazyObservation(self, partial=partial)
         # Standardized variable names to improve readability and changed key name
         current_agent_idx = self.agent_current_idx
         current_agent_coord = self.agent_coords_in_order[self.current_player][current_agent_idx]
         
-        if partial:
-            # crop obs to obs_range
-            transision_vector = (self.obs_range - 1 - current_agent_coord[0], 
-                                self.obs_range - 1 - current_agent_coord[1])
-            for i, matrix in enumerate(obs):
-                obs[i] = self.transition_matrix(matrix, transision_vector)
-                
-            obs = obs[:, :self.obs_range*2-1, :self.obs_range*2-1]
-            masked_obs = [(obs[0] != -1) * 1]
-            obs = np.concatenate([obs, masked_obs], axis=0)
-            agent_current_board[current_agent_coord[0], current_agent_coord[1]] = 1
-        
-        valid_actions = np.zeros(len(self.action_map.values()), dtype=bool)
-        for action in list(self.action_map.values()):
-            if self.is_valid_action(action):
-                valid_actions[action] = True
-        if sum(valid_actions) == 0:
-            for action in list(self.action_map.values()):
-                if self.is_valid_action(action, drop_self=True):
-                    valid_actions[action] = True
+        valid_actions = self.valid_action_mask()
             
         return {
             'player-id': self.current_player,
-            'observation': obs, 
+            'observation': self.get_observation(partial=partial), 
             'current-agent-id': current_agent_idx,
             'curr_agent_xy': dcopy(current_agent_coord),
             'valid_actions': valid_actions,
             'remaning_turns': self.remaining_turns,
             'hash_str': self.string_representation(),
             }
+    
+    def get_observation(self, partial=True):
+        """
+        Returns the 'observation' of get_state()
+        """
+        if partial:
+            # crop obs to obs_range, the padding of padded_board is the -1 of out of bounds cells
+            x, y = self.agent_coords_in_order[self.current_player][self.agent_current_idx]
+            size = 2 * self.obs_range - 1
+            window = self.padded_layers()[:, x:x + min(size, self.height), y:y + min(size, self.width)]
+            obs = np.empty((9,) + window.shape[1:], dtype=np.int64)
+            if self.current_player == 0:
+                obs[:6] = window[:6]
+            else:
+                obs[0:3] = window[3:6]
+                obs[3:6] = window[0:3]
+            obs[6:8] = window[6:8]
+            np.not_equal(window[0], -1, out=obs[8], casting='unsafe')
+        else:
+            # Standardized variable names to improve readability
+            players = [self.current_player, self.current_player ^ 1]
+            agent_board = self.agents[players]
+            wall_board = self.walls[players]
+            territory_board = self.territories[players]
+            obs = np.stack(
+                (
+                    agent_board[0], 
+                    wall_board[0], 
+                    territory_board[0], 
+                    agent_board[1],
+                    wall_board[1],
+                    territory_board[1],
+                    self.castles,
+                    self.ponds
+                ),
+                axis=0
+            )
+        return obs
 
+    def init_agent_index(self):
+        """
+        Builds the agent index kept up to date by next(): agent_positions[player][agent id] is the
+        current cell of the agent, agent_cells maps a cell to its (player, agent id).
+        The agent ids are the indices in agent_coords_in_order when the index is built,
+        which is filled in row-major order from the agent boards if empty
+        """
+        for player in range(self.num_players):
+            if len(self.agent_coords_in_order[player]) == 0:
+                self.agent_coords_in_order[player] = [(int(x), int(y)) for x, y in np.argwhere(self.agents[player] == 1)]
+        self.agent_positions = [list(coords) for coords in self.agent_coords_in_order]
+        self.agent_cells = {}
+        for player in range(self.num_players):
+            for agent_id, coord in enumerate(self.agent_positions[player]):
+                self.agent_cells[coord] = (player, agent_id)
+    
+    def _move_agent(self, player, position, next_position):
+        self._set_agent(player, next_position[0], next_position[1], 1)
+        self._set_agent(player, position[0], position[1], 0)
+        agent = self.agent_cells.pop(position)
+        self.agent_cells[next_position] = agent
+        self.agent_positions[player][agent[1]] = next_position
+    
+    def init_blocked_board(self):
+        """
+        Builds the board of the cells that no action can target: castles, ponds and the agents
+        listed in agent_coords_in_order, padded with one blocked cell on every side to cover
+        the out of bounds targets. The agents are refreshed by update_agent_coords_in_order()
+        """
+        self.static_blocked_board = np.ones((self.height + 2, self.width + 2), dtype=bool)
+        self.static_blocked_board[1:-1, 1:-1] = (self.castles == 1) | (self.ponds == 1)
+        self.update_blocked_board()
+        
+    def update_blocked_board(self):
+        self.blocked_board = self.static_blocked_board.copy()
+        for coords in self.agent_coords_in_order:
+            for x, y in coords:
+                self.blocked_board[x + 1, y + 1] = True
+    
+    def update_agent_coords_in_order(self):
+        """
+        Lists the agents of both players in row-major order from the agent index,
+        as Map.update_agent_coords_in_order() does from the boards
+        """
+        self.agent_coords_in_order = [sorted(positions) for positions in self.agent_positions]
+        if self.debug:
+            coords = self.agent_coords_in_order
+            Map.update_agent_coords_in_order(self)
+            assert coords == self.agent_coords_in_order, 'agent index mismatch'
+        self.update_blocked_board()
+        self.zobrist_hash ^= self.zobrist_listed
+        self.zobrist_listed = self.listed_zobrist()
+        self.zobrist_hash ^= self.zobrist_listed
+    
+    @property
+    def occupancy_board(self):
+        """
+        padded_layers() with one cell of padding, indexed like blocked_board
+        """
+        pad = self.obs_range - 1
+        return self.padded_layers()[:, pad - 1:pad + self.height + 1, pad - 1:pad + self.width + 1]
+    
+    def valid_action_masks(self, agent_indices=None):
+        """
+        Returns the (len(agent_indices), n_actions) valid-action masks of the given agents of the
+        current player (default: all of them), computed for all actions at once.
+        Same result as is_valid_action(), including the drop_self fallback of agents with no valid action
+        """
+        current_player = self.current_player
+        coords = np.array(self.agent_coords_in_order[current_player])
+        if agent_indices is not None:
+            coords = coords[agent_indices]
+        targets = coords[:, None, :] + self.action_offsets + 1
+        tx, ty = targets[..., 0], targets[..., 1]
+        n_moves = self.n_moves
+        
+        blocked = self.blocked_board[tx, ty]
+        # out of bounds targets are already blocked, the padding of the occupancy board is never read
+        occupancy = self.occupancy_board[:, tx, ty] == 1
+        valid_actions = np.zeros((len(coords), self.n_actions), dtype=bool)
+        # moves are also blocked by walls and by the agents of the team that moved in this turn
+        valid_actions[:, :n_moves] = ~(blocked[:, :n_moves] | occupancy[current_player * 3, :, :n_moves] |
+                                       occupancy[1, :, :n_moves] | occupancy[4, :, :n_moves])
+        changes_drop_self = ~blocked[:, n_moves:]
+        valid_actions[:, n_moves:len(self.action_offsets)] = \
+            changes_drop_self & ~occupancy[current_player * 3 + 1, :, n_moves:]
+        empty = ~valid_actions.any(axis=1)
+        valid_actions[empty, n_moves:len(self.action_offsets)] = changes_drop_self[empty]
+        return valid_actions
+    
+    def valid_action_mask(self, agent_idx=None):
+        """
+        Returns the valid actions of an agent of the current player (default: the current agent),
+        if no action is valid the agent is allowed to destroy its own walls
+        """
+        if agent_idx is None:
+            agent_idx = self.agent_current_idx
+        return self.valid_action_masks([agent_idx])[0]
+    
+    def get_all_agent_observations(self):
+        """
+        Returns the partial observations of get_state() for all agents of the current player
+        as a (num_agents, 9, 2 * obs_range - 1, 2 * obs_range - 1) array, and their
+        (num_agents, n_actions) valid-action masks.
+        Windows are centered on agent_coords_in_order, so at the start of a turn they are
+        what get_state() returns to each agent if the others do not move
+        """
+        coords = np.array(self.agent_coords_in_order[self.current_player])
+        size = 2 * self.obs_range - 1
+        window_shape = (min(size, self.height), min(size, self.width))
+        windows = np.lib.stride_tricks.sliding_window_view(self.padded_layers(), window_shape, axis=(1, 2))
+        windows = windows[:, coords[:, 0], coords[:, 1]]
+        layers = [0, 1, 2, 3, 4, 5, 6, 7] if self.current_player == 0 else [3, 4, 5, 0, 1, 2, 6, 7]
+        obs = np.empty((len(coords), 9) + window_shape, dtype=np.int64)
+        obs[:, :8] = windows[layers].transpose(1, 0, 2, 3)
+        obs[:, 8] = windows[0] != -1
+        return obs, self.valid_action_masks()
+    
     def get_scores(self, player):
         """
         Recalculates the score of the current player based on current state
@@ -268,21 +551,248 @@ class State(Map):
 
         return wall_score, closed_territory_score, open_territory_score, castle_score
     
-    def update_score(self):
+    def border_reachable(self, player):
         """
-        Updates the score of the current player based on current state
+        Returns a boolean board of the cells reachable from the border
+        without crossing a wall of the given player
         """
+        open_cells = self.walls[player] == 0
+        if open_cells.all():
+            return open_cells
+        from scipy import ndimage # loaded on first use, importing scipy is slow
+        # default structure of ndimage.label is the 4-neighbourhood used by get_scores
+        labels, n_labels = ndimage.label(open_cells)
+        border_labels = np.concatenate((labels[0], labels[-1], labels[:, 0], labels[:, -1]))
+        touches_border = np.zeros(n_labels + 1, dtype=bool)
+        touches_border[border_labels] = True
+        touches_border[0] = False
+        return touches_border[labels]
+    
+    def get_scores_vectorized(self, player):
+        """
+        Same as get_scores() with the flood fill done by connected component labelling
+        and the territory update done on whole boards
+        """
+        opponent = 1 - player
+        enclosed = ~self.border_reachable(player) & (self.walls[player] == 0)
+        
+        wall_score = self.walls[player].sum()
+        closed_territory_score = enclosed.sum()
+        castle_score = (enclosed & (self.castles == 1)).sum()
+        
+        territory = (self.territories[player] == 1) & (self.walls[opponent] == 0)
+        self.territories[player] = territory | enclosed
+        open_territory_score = self.territories[player].sum() - closed_territory_score
+        
+        return wall_score, closed_territory_score, open_territory_score, castle_score
+    
+    def init_score_engine(self):
+        """
+        Rebuilds the boards and counters used by the incremental scoring from the
+        current walls. Must be called again if the walls are modified outside of next()
+        """
+        self.reachable = np.zeros((self.num_players, self.height, self.width), dtype=bool)
+        self.enclosed = np.zeros((self.num_players, self.height, self.width), dtype=bool)
+        self.wall_counts = [0 for _ in range(self.num_players)]
+        self.enclosed_counts = [0 for _ in range(self.num_players)]
+        self.enclosed_castles = [0 for _ in range(self.num_players)]
+        self.territory_counts = [0 for _ in range(self.num_players)]
         for player in range(self.num_players):
-            wall_score, closed_territory_score, open_territory_score, castle_score = self.get_scores(player)
-            self.wall_scores[player] = wall_score
-            self.closed_territory_scores[player] = closed_territory_score
-            self.open_territory_scores[player] = open_territory_score
-            self.territory_scores[player] = open_territory_score + closed_territory_score
-            self.castle_scores[player] = castle_score
+            self.reachable[player] = self.border_reachable(player)
+            self.enclosed[player] = ~self.reachable[player] & (self.walls[player] == 0)
+            self.wall_counts[player] = int(self.walls[player].sum())
+            self.enclosed_counts[player] = int(self.enclosed[player].sum())
+            self.enclosed_castles[player] = int((self.enclosed[player] & (self.castles == 1)).sum())
+        self._dirty_walls = []
+        # territories are brought in line with the walls on the first update, as get_scores does
+        self._territories_synced = False
+    
+    def _flood_region(self, player, x, y):
+        """
+        Collects the reachable region of the given player containing (x, y).
+        Returns None as soon as the region touches the border
+        """
+        height = self.height
+        width = self.width
+        reachable = self.reachable[player]
+        region = [(x, y)]
+        visited = {(x, y)}
+        st = [(x, y)]
+        while len(st) > 0:
+            cx, cy = st.pop()
+            if cx == 0 or cy == 0 or cx == height - 1 or cy == width - 1:
+                return None
+            for nx, ny in ((cx, cy + 1), (cx, cy - 1), (cx + 1, cy), (cx - 1, cy)):
+                if reachable[nx][ny] and (nx, ny) not in visited:
+                    visited.add((nx, ny))
+                    region.append((nx, ny))
+                    st.append((nx, ny))
+        return region
+    
+    def _add_wall(self, player, x, y, changed):
+        """
+        Updates the reachability of the given player after a wall is built on (x, y)
+        """
+        self.wall_counts[player] += 1
+        if self.enclosed[player][x][y]:
+            self.enclosed[player][x][y] = False
+            self.enclosed_counts[player] -= 1
+            changed.append((x, y))
+            return
+        self.reachable[player][x][y] = False
+        seen = set()
+        for nx, ny in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y)):
+            if not self.in_bounds(nx, ny) or not self.reachable[player][nx][ny] \
+                    or (nx, ny) in seen:
+                continue
+            region = self._flood_region(player, nx, ny)
+            if region is None:
+                continue
+            seen.update(region)
+            for cx, cy in region:
+                self.reachable[player][cx][cy] = False
+                self.enclosed[player][cx][cy] = True
+                if self.castles[cx][cy] == 1:
+                    self.enclosed_castles[player] += 1
+            self.enclosed_counts[player] += len(region)
+            changed.extend(region)
+    
+    def _remove_wall(self, player, x, y, changed):
+        """
+        Updates the reachability of the given player after the wall on (x, y) is destroyed
+        """
+        self.wall_counts[player] -= 1
+        height = self.height
+        width = self.width
+        reachable = self.reachable[player]
+        enclosed = self.enclosed[player]
+        neighbors = [(nx, ny) for nx, ny in ((x, y + 1), (x, y - 1), (x + 1, y), (x - 1, y))
+                     if self.in_bounds(nx, ny)]
+        if not (x == 0 or y == 0 or x == height - 1 or y == width - 1) and \
+                not any(reachable[nx][ny] for nx, ny in neighbors):
+            enclosed[x][y] = True
+            self.enclosed_counts[player] += 1
+            changed.append((x, y))
+            return
+        # the destroyed wall opens every enclosed region around it to the border
+        reachable[x][y] = True
+        st = [(x, y)]
+        while len(st) > 0:
+            cx, cy = st.pop()
+            for nx, ny in ((cx, cy + 1), (cx, cy - 1), (cx + 1, cy), (cx - 1, cy)):
+                if 0 <= nx < height and 0 <= ny < width and enclosed[nx][ny]:
+                    enclosed[nx][ny] = False
+                    reachable[nx][ny] = True
+                    self.enclosed_counts[player] -= 1
+                    if self.castles[nx][ny] == 1:
+                        self.enclosed_castles[player] -= 1
+                    changed.append((nx, ny))
+                    st.append((nx, ny))
+    
+    def _update_territory(self, player, x, y):
+        """
+        Applies the territory rule of get_scores() to a single cell
+        """
+        opponent = 1 - player
+        old = self.territories[player][x][y]
+        new = 1 if self.enclosed[player][x][y] else \
+            (0 if self.walls[opponent][x][y] == 1 else old)
+        if new != old:
+            if self._territory_journal is not None:
+                self._territory_journal.append((player, x, y, old))
+            self.territories[player][x][y] = new
+            self.territory_counts[player] += 1 if new else -1
+            self.zobrist_hash ^= self.zobrist_keys[4 + player][x][y]
+    
+    def _sync_territories(self):
+        for player in range(self.num_players):
+            opponent = 1 - player
+            territory = (self.territories[player] == 1) & (self.walls[opponent] == 0)
+            self.territories[player] = territory | self.enclosed[player]
+            self.territory_counts[player] = int(self.territories[player].sum())
+        self._territories_synced = True
+    
+    def _update_regions(self, player, x, y):
+        """
+        Brings the reachability of the player in line with its wall on (x, y),
+        returns the cells whose territory has to be re-examined
+        """
+        changed = [(x, y)]
+        is_wall = self.walls[player][x][y] == 1
+        was_wall = not (self.reachable[player][x][y] or self.enclosed[player][x][y])
+        if is_wall and not was_wall:
+            self._add_wall(player, x, y, changed)
+        elif was_wall and not is_wall:
+            self._remove_wall(player, x, y, changed)
+        return changed
+    
+    def _update_territories(self):
+        """
+        Brings the reachability and the territories in line with the walls changed since the last call
+        """
+        for x, y in self._dirty_walls:
+            for player in range(self.num_players):
+                for cx, cy in self._update_regions(player, x, y):
+                    self._update_territory(player, cx, cy)
+        if not self._territories_synced:
+            territories = self.territories.copy()
+            self._sync_territories()
+            self._hash_territory_changes(territories)
+        self._dirty_walls = []
+    
+    def _update_score_incremental(self):
+        self._update_territories()
+        for player in range(self.num_players):
+            self.wall_scores[player] = self.wall_counts[player]
+            self.closed_territory_scores[player] = self.enclosed_counts[player]
+            self.open_territory_scores[player] = self.territory_counts[player] - self.enclosed_counts[player]
+            self.territory_scores[player] = self.territory_counts[player]
+            self.castle_scores[player] = self.enclosed_castles[player]
+    
+    def update_score(self):
+        """
+        Updates the score of the current player based on current state.
+        With the incremental backend only the regions around the walls changed
+        since the last call are re-examined. In rollout mode the incremental backend is always used
+        """
+        if self.scoring == 'incremental' or self.rollout_mode:
+            self._update_score_incremental()
+        else:
+            territories = self.territories.copy()
+            get_scores = self.get_scores if self.scoring == 'python' else self.get_scores_vectorized
+            for player in range(self.num_players):
+                wall_score, closed_territory_score, open_territory_score, castle_score = get_scores(player)
+                self.wall_scores[player] = wall_score
+                self.closed_territory_scores[player] = closed_territory_score
+                self.open_territory_scores[player] = open_territory_score
+                self.territory_scores[player] = open_territory_score + closed_territory_score
+                self.castle_scores[player] = castle_score
+            self._hash_territory_changes(territories)
+        self._dirty_walls = []
+            
+        if self.debug:
+            self.check_scores()
             
         for player in range(self.num_players):
             self.players[player].scores = self.scores[player]
     
+    def check_scores(self):
+        """
+        Compares the scores of the selected backend with a full recomputation by get_scores()
+        on a copy of the state, raises AssertionError on any mismatch
+        """
+        reference = dcopy(self)
+        for player in range(self.num_players):
+            wall_score, closed_territory_score, open_territory_score, castle_score = \
+                reference.get_scores(player)
+            assert wall_score == self.wall_scores[player], 'wall score mismatch'
+            assert closed_territory_score == self.closed_territory_scores[player], \
+                'closed territory score mismatch'
+            assert open_territory_score == self.open_territory_scores[player], \
+                'open territory score mismatch'
+            assert castle_score == self.castle_scores[player], 'castle score mismatch'
+        assert np.array_equal(reference.territories, self.territories), 'territory mismatch'
+    
     def get_type_action(self, action):
         """
         Returns the type of the given action and the corresponding action list item.
@@ -301,10 +811,10 @@ class State(Map):
         else:
             return ('Stay',)
     
-    def is_valid_action(self, action, drop_self=False):
+    def is_valid_action(self, action, drop_self=False, agent_idx=None):
         current_player = self.current_player
         agent_coords_in_order = self.agent_coords_in_order
-        agent_current_idx = self.agent_current_idx
+        agent_current_idx = self.agent_current_idx if agent_idx is None else agent_idx
         current_position = agent_coords_in_order[current_player][agent_current_idx]
         
         valid = True
@@ -316,11 +826,11 @@ class State(Map):
             if not self.in_bounds(next_position[0], next_position[1]):
                 valid = False
                 
-            elif next_position in self.agent_coords_in_order[0] or \
-                        next_position in self.agent_coords_in_order[1]:
+            elif self.blocked_board[next_position[0] + 1][next_position[1] + 1]:
+                # listed agents, castles and ponds
                 valid = False
                 
-            elif self.agents[current_player][next_position[0]][next_position[1]] == 1:
+            elif self.agent_cells.get(next_position, (None,))[0] == current_player:
                 ''' in turn (N agent actions at the same time), only one agent can move at an area, 
                     so the other agent is moved into the same area befores
                     agents save next coordinates but agent_coords_in_order is not updated to check this '''
@@ -349,8 +859,7 @@ class State(Map):
             elif self.ponds[next_position[0]][next_position[1]] == 1:
                 valid = False
                 
-            elif next_position in self.agent_coords_in_order[0] or \
-                        next_position in self.agent_coords_in_order[1]:
+            elif self.blocked_board[next_position[0] + 1][next_position[1] + 1]:
                 valid = False
             elif not drop_self and self.walls[current_player][next_position[0]][next_position[1]] == 1:
                 valid = False
@@ -360,6 +869,105 @@ class State(Map):
         return valid
     
     
+    def _save_turn(self):
+        """
+        Returns what update_agent_coords_in_order() replaces when the player switches
+        """
+        return self.agent_coords_in_order, self.blocked_board, self.zobrist_listed
+    
+    def _restore_turn(self, turn):
+        self.agent_coords_in_order, self.blocked_board, self.zobrist_listed = turn
+    
+    def _save_scoring(self):
+        """
+        Starts recording the changes of the next update_score(), see _restore_scoring()
+        """
+        if self.scoring != 'incremental' and not self.rollout_mode:
+            return self.territories.copy()
+        territories = None if self._territories_synced else self.territories.copy()
+        self._territory_journal = []
+        return (list(self.territory_counts), self._territory_journal, territories)
+    
+    def _restore_scoring(self, saved, wall_cells):
+        """
+        Takes back the territory and reachability changes of update_score() once the walls are restored
+        """
+        if self.scoring != 'incremental' and not self.rollout_mode:
+            self.territories[:] = saved
+            return
+        territory_counts, journal, territories = saved
+        for x, y in wall_cells:
+            for player in range(self.num_players):
+                self._update_regions(player, x, y)
+        for player, x, y, old in reversed(journal):
+            self.territories[player][x][y] = old
+        if territories is not None:
+            self.territories[:] = territories
+            self._territories_synced = False
+        self.territory_counts = territory_counts
+    
+    def set_rollout_mode(self, enabled=True):
+        """
+        In rollout mode next() keeps the territories up to date, which the sticky territory
+        rule needs, but skips the score counters and the players. The scores are computed
+        when the game ends or by calling update_score(), and are the same as with per-step
+        scoring. Entries pushed in rollout mode must be popped before leaving it
+        """
+        if enabled == self.rollout_mode:
+            return
+        self.rollout_mode = enabled
+        if enabled and self.scoring != 'incremental':
+            # the reachability boards are only kept up to date by the incremental backend
+            self.init_score_engine()
+        if not enabled:
+            self.update_score()
+    
+    def push(self, action):
+        """
+        Plays the action like next() and keeps an undo entry so that pop() can take it back,
+        used by tree search to walk a single state without copies
+        """
+        self._undo = Undo(self)
+        try:
+            is_valid = self.next(action)
+        finally:
+            self._undo_stack.append(self._undo)
+            self._undo = None
+            self._territory_journal = None
+        return is_valid
+    
+    def pop(self):
+        """
+        Takes back the last action played by push()
+        """
+        undo = self._undo_stack.pop()
+        if undo.agent is not None:
+            player, (x, y), (next_x, next_y) = undo.agent
+            self._move_agent(player, (next_x, next_y), (x, y))
+        for player, x, y, value in reversed(undo.walls):
+            self._set_wall(player, x, y, value)
+        if undo.scoring is not None:
+            self._restore_scoring(undo.scoring, [(x, y) for _, x, y, _ in undo.walls])
+        self.wall_scores, self.castle_scores, self.open_territory_scores, \
+            self.closed_territory_scores, self.territory_scores = undo.scores
+        self.current_player = undo.current_player
+        self.agent_current_idx = undo.agent_current_idx
+        self.remaining_turns = undo.remaining_turns
+        self._restore_turn(undo.turn)
+        self.zobrist_hash = undo.zobrist_hash
+        if undo.scoring is not None and not self.rollout_mode:
+            for player in range(self.num_players):
+                self.players[player].scores = self.scores[player]
+    
+    def _set_agent(self, player, x, y, value):
+        self.agents[player][x][y] = value
+        
+    def _set_wall(self, player, x, y, value):
+        self.walls[player][x][y] = value
+        
+    def _is_wall(self, player, x, y):
+        return self.walls[player][x][y] == 1
+    
     def is_terminal(self):
         """
         Checks if the game has ended by evaluating if there are any remaining turns left.
@@ -368,8 +976,53 @@ class State(Map):
         """
         return self.remaining_turns == 0
     
+    def remaining_plies(self):
+        """
+        Number of agent actions left until the end of the game
+        """
+        plies_per_turn = self.num_players * self.num_agents
+        played = self.current_player * self.num_agents + self.agent_current_idx
+        return max(self.remaining_turns * plies_per_turn - played, 0)
     
-    def next(self, action):
+    
+    def _watch_territories(self):
+        """
+        Starts collecting the territory changes of the next update, see _territory_changes()
+        """
+        if (self.scoring == 'incremental' or self.rollout_mode) and self._territories_synced:
+            owned = self._territory_journal is None
+            if owned:
+                self._territory_journal = []
+            return self._territory_journal, len(self._territory_journal), owned
+        return self.territories.copy()
+    
+    def _territory_changes(self, watched):
+        """
+        Returns the (player, x, y, new value) territory changes since _watch_territories()
+        """
+        if isinstance(watched, np.ndarray):
+            return [(int(player), int(x), int(y), int(self.territories[player][x][y]))
+                    for player, x, y in zip(*np.nonzero(watched != self.territories))]
+        journal, start, owned = watched
+        if owned:
+            self._territory_journal = None
+        return [(player, x, y, 1 - int(old)) for player, x, y, old in journal[start:]]
+    
+    def _score_components(self):
+        return (list(self.wall_scores), list(self.castle_scores), list(self.open_territory_scores),
+                list(self.closed_territory_scores))
+    
+    def is_territory(self, player, x, y):
+        return self.territories[player][x][y] == 1
+    
+    def next(self, action, return_delta=False):
+        """
+        Plays the action for the current agent and passes the turn to the next agent.
+        Returns whether the action was valid, or a ScoreDelta if return_delta is True
+        """
+        if return_delta:
+            components = self._score_components()
+            cells = []
         action_type = self.get_type_action(action)
         current_player = self.current_player
         agent_current_idx = self.agent_current_idx
@@ -384,30 +1037,66 @@ class State(Map):
                 next_position = (self.direction_map[direction][0] + current_position[0],
                             self.direction_map[direction][1] + current_position[1])
                 
-                self.agents[current_player][next_position[0]][next_position[1]] = 1
-                self.agents[current_player][current_position[0]][current_position[1]] = 0
+                self._move_agent(current_player, current_position, next_position)
+                if self._undo is not None:
+                    self._undo.agent = (current_player, current_position, next_position)
+                keys = self.zobrist_keys[current_player]
+                self.zobrist_hash ^= keys[next_position[0]][next_position[1]] ^ \
+                    keys[current_position[0]][current_position[1]]
                 
             elif action_type[0] == 'Change':
                 direction = action_type[1]
                 wall_coord = (self.direction_map[direction][0] + current_position[0],
                             self.direction_map[direction][1] + current_position[1])
-                if self.walls[0][wall_coord[0]][wall_coord[1]] == 0 \
-                            and self.walls[1][wall_coord[0]][wall_coord[1]] == 0:
-                    self.walls[current_player][wall_coord[0]][wall_coord[1]] = 1
+                if not self._is_wall(0, wall_coord[0], wall_coord[1]) \
+                            and not self._is_wall(1, wall_coord[0], wall_coord[1]):
+                    self._set_wall(current_player, wall_coord[0], wall_coord[1], 1)
+                    if self._undo is not None:
+                        self._undo.walls.append((current_player, wall_coord[0], wall_coord[1], 0))
+                    self.zobrist_hash ^= self.zobrist_keys[2 + current_player][wall_coord[0]][wall_coord[1]]
                 
                 else:
-                    self.walls[0][wall_coord[0]][wall_coord[1]] = 0
-                    self.walls[1][wall_coord[0]][wall_coord[1]] = 0
+                    for player in range(self.num_players):
+                        if self._is_wall(player, wall_coord[0], wall_coord[1]):
+                            self._set_wall(player, wall_coord[0], wall_coord[1], 0)
+                            if self._undo is not None:
+                                self._undo.walls.append((player, wall_coord[0], wall_coord[1], 1))
+                            self.zobrist_hash ^= self.zobrist_keys[2 + player][wall_coord[0]][wall_coord[1]]
+                self._dirty_walls.append(wall_coord)
             else:
                 pass
             
-            self.update_score()
+            if self._undo is not None:
+                self._undo.scoring = self._save_scoring()
+            if return_delta:
+                watched = self._watch_territories()
+            if not self.rollout_mode:
+                self.update_score()
+            elif self._dirty_walls:
+                self._update_territories()
+            if return_delta:
+                cells = self._territory_changes(watched)
             
+        self.zobrist_hash ^= self.zobrist_turn_keys[self.current_player][self.agent_current_idx]
         self.agent_current_idx = (agent_current_idx + 1) % self.num_agents
         if self.agent_current_idx == 0:
             self.current_player = (self.current_player + 1) % self.num_players
             self.update_agent_coords_in_order()
             if self.current_player == 0:
                 self.remaining_turns -= 1
-                
+                if self.rollout_mode and self.remaining_turns == 0:
+                    self.update_score()
+        self.zobrist_hash ^= self.zobrist_turn_keys[self.current_player][self.agent_current_idx]
+        
+        if self.debug:
+            assert self.zobrist_hash == self.compute_zobrist(), 'zobrist hash mismatch'
+        
+        if return_delta:
+            walls, castles, open_territories, closed_territories = [
+                tuple(new - old for old, new in zip(old_values, new_values))
+                for old_values, new_values in zip(components, self._score_components())]
+            scores = tuple(self.alpha * walls[player] + self.beta * castles[player] +
+                           self.gamma * (open_territories[player] + closed_territories[player])
+                           for player in range(self.num_players))
+            return ScoreDelta(is_valid, walls, castles, open_territories, closed_territories, scores, cells)
         return is_valid
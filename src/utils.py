@@ -6,16 +6,48 @@ import numbers
 import numpy as np
 import random
 import os
-import torch
+import sys
 import shutil
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.style.use('ggplot')
+
+# torch and matplotlib are slow to import, they are loaded on first use by import_torch() and pyplot()
+
+_torch_seed = None # seed given to set_seed(), applied to torch by the next import_torch()
 
 def set_seed(seed):
-	torch.manual_seed(seed)
+	"""
+	Seeds random, numpy and torch, now if it is loaded, else when import_torch() first loads it
+	"""
+	global _torch_seed
+	_torch_seed = seed
+	if 'torch' in sys.modules:
+		import_torch()
 	np.random.seed(seed)
 	random.seed(seed)
+
+def import_torch():
+    """
+    Returns torch, seeded with the seed given to set_seed() on the first call after it.
+    Import torch through it for set_seed() to seed torch when torch is loaded after it
+    """
+    global _torch_seed
+    import torch
+    if _torch_seed is not None:
+        torch.manual_seed(_torch_seed)
+        _torch_seed = None
+    return torch
+
+_ggplot_style = False
+
+def pyplot():
+    """
+    Returns matplotlib.pyplot, imported and set to the ggplot style on the first call
+    """
+    global _ggplot_style
+    import matplotlib.pyplot as plt
+    if not _ggplot_style:
+        plt.style.use('ggplot')
+        _ggplot_style = True
+    return plt
     
 class dotdict(dict):
     def __getattr__(self, name):
@@ -25,6 +57,7 @@ def dtanh(x):
     return 1 / np.cosh(x) ** (0.2)
 
 def plot_elo(ratings, save_dir):
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.plot(ratings)
     ax.set_xlabel('Episodes (x20)')
@@ -82,6 +115,7 @@ def save_training_checkpoint(state, is_best, episode_count):
 	:param filename:
 	:return:
 	"""
+	torch = import_torch()
 	filename = str(episode_count) + 'checkpoint.path.rar'
 	torch.save(state, filename)
 	if is_best:
@@ -108,6 +142,7 @@ class OrnsteinUhlenbeckActionNoise:
 		return self.X
 
 def plot_timeseries(history, save_dir, x_label, y_label, title):
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.plot(history)
     ax.set_xlabel(x_label)
@@ -119,6 +154,7 @@ def plot_timeseries(history, save_dir, x_label, y_label, title):
     plt.close()
     
 def plot_timeseries(history, save_dir, x_label, y_label, title):
+    plt = pyplot()
     fig, ax = plt.subplots()
     ax.plot(history)
     ax.set_xlabel(x_label)
@@ -0,0 +1,312 @@
+import numpy as np
+from scipy import ndimage
+from src.map import Map
+
+
+class VecAgentFighting(object):
+    """
+    Runs num_envs games in lockstep. Each call to step() takes one action per game
+    and applies it to the current agent of that game, exactly as AgentFighting.step().
+
+    Games of different sizes are stored in the top-left corner of
+    (num_envs, 2, height-max, width-max) boards. The cells outside of a game are
+    treated as out of bounds. Finished games are reset automatically. Their final scores
+    are kept in final_scores until the next step.
+    """
+    def __init__(self, args, configs, num_envs, seed=None):
+        self.args = args
+        self.configs = configs
+        self.num_envs = num_envs
+        self.rng = np.random.default_rng(seed)
+
+        self.action_space = {
+            'Move': ['U', 'D', 'L', 'R', 'UL', 'UR', 'DL', 'DR'],
+            'Change': ['U', 'D', 'L', 'R'],
+            'Stay': 1
+        }
+        self.direction_map = {
+            'U': (-1, 0),
+            'D': (1, 0),
+            'L': (0, -1),
+            'R': (0, 1),
+            'UL': (-1, -1),
+            'UR': (-1, 1),
+            'DL': (1, -1),
+            'DR': (1, 1)
+        }
+        self.n_moves = len(self.action_space['Move'])
+        self.n_actions = len(self.action_space['Move']) + len(self.action_space['Change']) + 1
+        self.action_offsets = np.array(
+            [self.direction_map[d] for d in self.action_space['Move']] +
+            [self.direction_map[d] for d in self.action_space['Change']])
+        self.num_players = 2
+        self.alpha = 1 # effect of wall
+        self.beta = 20 # effect of castle
+        self.gamma = 5 # effect of territory
+
+        map_configs = configs['map']
+        self.map = Map(map_configs)
+        self.obs_range = map_configs['obs_range']
+        self.height = map_configs['height-max']
+        self.width = map_configs['width-max']
+        self.max_num_agents = map_configs['max-num-agents']
+
+        n, h, w = num_envs, self.height, self.width
+        self.agents = np.zeros((n, 2, h, w), dtype=np.int8)
+        self.walls = np.zeros((n, 2, h, w), dtype=np.int8)
+        self.territories = np.zeros((n, 2, h, w), dtype=np.int8)
+        self.castles = np.zeros((n, h, w), dtype=np.int8)
+        self.ponds = np.zeros((n, h, w), dtype=np.int8)
+        self.inside = np.zeros((n, h, w), dtype=bool)
+        self.heights = np.zeros(n, dtype=np.int64)
+        self.widths = np.zeros(n, dtype=np.int64)
+        # agent_coords_in_order of every game, unused slots hold (-1, -1)
+        self.agent_coords = np.full((n, 2, self.max_num_agents, 2), -1, dtype=np.int64)
+        # where the agents are now, agent_coords is only refreshed when the player switches
+        self.agent_positions = np.full((n, 2, self.max_num_agents, 2), -1, dtype=np.int64)
+        self.num_agents = np.zeros(n, dtype=np.int64)
+        self.current_player = np.zeros(n, dtype=np.int64)
+        self.agent_current_idx = np.zeros(n, dtype=np.int64)
+        self.remaining_turns = np.zeros(n, dtype=np.int64)
+        self.wall_scores = np.zeros((n, 2), dtype=np.int64)
+        self.castle_scores = np.zeros((n, 2), dtype=np.int64)
+        self.territory_scores = np.zeros((n, 2), dtype=np.int64)
+        self.final_scores = np.zeros((n, 2), dtype=np.int64)
+
+        # 4-neighbourhood inside each board, never across games
+        self._label_structure = np.zeros((3, 3, 3), dtype=bool)
+        self._label_structure[1] = ndimage.generate_binary_structure(2, 1)
+        self.reset()
+
+    @property
+    def scores(self):
+        return self.alpha * self.wall_scores + self.beta * self.castle_scores + \
+            self.gamma * self.territory_scores
+
+    def _reset_games(self, games):
+        for g in games:
+            self.map.make_random_map(rng=self.rng)
+            h, w = self.map.height, self.map.width
+            for board in (self.agents, self.walls, self.territories, self.castles, self.ponds, self.inside):
+                board[g] = 0
+            self.agents[g, :, :h, :w] = self.map.agents
+            self.castles[g, :h, :w] = self.map.castles
+            self.ponds[g, :h, :w] = self.map.ponds
+            self.inside[g, :h, :w] = True
+            self.heights[g], self.widths[g] = h, w
+            self.agent_coords[g] = -1
+            self.agent_coords[g, :, :self.map.num_agents] = self.map.agent_coords_in_order
+            self.agent_positions[g] = self.agent_coords[g]
+            self.num_agents[g] = self.map.num_agents
+            self.current_player[g] = 0
+            self.agent_current_idx[g] = 0
+            self.remaining_turns[g] = self.map.remaining_turns
+            self.wall_scores[g] = 0
+            self.castle_scores[g] = 0
+            self.territory_scores[g] = 0
+
+    def reset(self):
+        """
+        Starts a new game in every slot and returns the batched state
+        """
+        self._reset_games(range(self.num_envs))
+        return self.get_state()
+
+    def is_terminal(self):
+        return self.remaining_turns == 0
+
+    def _current_positions(self):
+        games = np.arange(self.num_envs)
+        return self.agent_coords[games, self.current_player, self.agent_current_idx]
+
+    def _action_masks(self):
+        """
+        Returns the valid moves (num_envs, 8) and the valid changes without and with
+        drop_self (num_envs, 4) of the current agent of every game
+        """
+        n = self.num_envs
+        games = np.arange(n)
+        # boards padded with one blocked ring so that every target cell can be indexed
+        listed = np.zeros((n, self.height + 2, self.width + 2), dtype=bool)
+        listed_games, listed_players, listed_idx = np.nonzero(self.agent_coords[..., 0] >= 0)
+        listed_coords = self.agent_coords[listed_games, listed_players, listed_idx]
+        listed[listed_games, listed_coords[:, 0] + 1, listed_coords[:, 1] + 1] = True
+
+        def pad(board):
+            return np.pad(board, ((0, 0), (1, 1), (1, 1)), constant_values=True)
+
+        blocked = pad((self.castles == 1) | (self.ponds == 1) | ~self.inside) | listed
+        own_walls = self.walls[games, self.current_player] == 1
+        moving_blocked = blocked | pad((self.agents[games, self.current_player] == 1) |
+                                       (self.walls == 1).any(axis=1))
+        change_blocked = blocked | pad(own_walls)
+
+        positions = self._current_positions()
+        targets = positions[:, None, :] + self.action_offsets[None, :, :] + 1
+        move_x, move_y = targets[:, :self.n_moves, 0], targets[:, :self.n_moves, 1]
+        change_x, change_y = targets[:, self.n_moves:, 0], targets[:, self.n_moves:, 1]
+        moves = ~moving_blocked[games[:, None], move_x, move_y]
+        changes = ~change_blocked[games[:, None], change_x, change_y]
+        changes_drop_self = ~blocked[games[:, None], change_x, change_y]
+        return moves, changes, changes_drop_self
+
+    def get_valid_actions(self):
+        """
+        Returns the (num_envs, n_actions) valid-action masks of State.get_state()
+        """
+        moves, changes, changes_drop_self = self._action_masks()
+        valid_actions = np.zeros((self.num_envs, self.n_actions), dtype=bool)
+        valid_actions[:, :self.n_moves] = moves
+        valid_actions[:, self.n_moves:self.n_actions - 1] = changes
+        empty = ~valid_actions.any(axis=1)
+        valid_actions[empty, self.n_moves:self.n_actions - 1] = changes_drop_self[empty]
+        return valid_actions
+
+    def get_observations(self):
+        """
+        Returns the (num_envs, 9, 2 * obs_range - 1, 2 * obs_range - 1) partial observations
+        of State.get_state(), cropped around the current agent of every game
+        """
+        n = self.num_envs
+        games = np.arange(n)
+        size = 2 * self.obs_range - 1
+        pad = self.obs_range - 1
+        players = np.stack((self.current_player, self.current_player ^ 1), axis=1)
+        board = np.stack((
+            self.agents[games, players[:, 0]],
+            self.walls[games, players[:, 0]],
+            self.territories[games, players[:, 0]],
+            self.agents[games, players[:, 1]],
+            self.walls[games, players[:, 1]],
+            self.territories[games, players[:, 1]],
+            self.castles,
+            self.ponds
+        ), axis=1)
+        board = np.where(self.inside[:, None], board, -1).astype(np.int8)
+        board = np.pad(board, ((0, 0), (0, 0), (pad, pad), (pad, pad)), constant_values=-1)
+
+        positions = self._current_positions()
+        rows = positions[:, 0, None] + np.arange(size)
+        cols = positions[:, 1, None] + np.arange(size)
+        obs = np.empty((n, 9, size, size), dtype=np.int8)
+        obs[:, :8] = board[games[:, None, None, None], np.arange(8)[None, :, None, None],
+                           rows[:, None, :, None], cols[:, None, None, :]]
+        obs[:, 8] = obs[:, 0] != -1
+        return obs
+
+    def get_state(self):
+        """
+        Batched version of State.get_state(), every entry has num_envs rows
+        """
+        return {
+            'player-id': self.current_player.copy(),
+            'observation': self.get_observations(),
+            'current-agent-id': self.agent_current_idx.copy(),
+            'curr_agent_xy': self._current_positions(),
+            'valid_actions': self.get_valid_actions(),
+            'remaning_turns': self.remaining_turns.copy(),
+        }
+
+    def _update_scores(self, games):
+        """
+        Recomputes the scores and territories of the given games, see State.get_scores()
+        """
+        if len(games) == 0:
+            return
+        inside = self.inside[games]
+        castles = self.castles[games] == 1
+        for player in range(self.num_players):
+            walls = self.walls[games, player] == 1
+            # the cells outside of a game and the padding ring are open and touch the border
+            open_cells = np.pad(~walls, ((0, 0), (1, 1), (1, 1)), constant_values=True)
+            labels, _ = ndimage.label(open_cells, structure=self._label_structure)
+            outside = labels[:, 0, 0]
+            reachable = (labels == outside[:, None, None])[:, 1:-1, 1:-1]
+            enclosed = ~reachable & ~walls & inside
+            territory = ((self.territories[games, player] == 1) &
+                         (self.walls[games, 1 - player] == 0)) | enclosed
+            self.territories[games, player] = territory
+            self.wall_scores[games, player] = walls.sum(axis=(1, 2))
+            self.castle_scores[games, player] = (enclosed & castles).sum(axis=(1, 2))
+            self.territory_scores[games, player] = territory.sum(axis=(1, 2))
+
+    def _next(self, actions):
+        """
+        Vectorized State.next(), returns which actions were valid
+        """
+        n = self.num_envs
+        current_player = self.current_player
+        moves, _, changes_drop_self = self._action_masks()
+        is_move = actions < self.n_moves
+        is_change = (actions >= self.n_moves) & (actions < self.n_actions - 1)
+        valid = np.zeros(n, dtype=bool)
+        valid[is_move] = moves[is_move, actions[is_move]]
+        valid[is_change] = changes_drop_self[is_change, actions[is_change] - self.n_moves]
+
+        positions = self._current_positions()
+        offsets = self.action_offsets[np.minimum(actions, len(self.action_offsets) - 1)]
+        targets = positions + offsets
+
+        moving = np.nonzero(valid & is_move)[0]
+        self.agents[moving, current_player[moving], targets[moving, 0], targets[moving, 1]] = 1
+        self.agents[moving, current_player[moving], positions[moving, 0], positions[moving, 1]] = 0
+        self.agent_positions[moving, current_player[moving], self.agent_current_idx[moving]] = targets[moving]
+
+        changing = np.nonzero(valid & is_change)[0]
+        x, y = targets[changing, 0], targets[changing, 1]
+        empty = (self.walls[changing, 0, x, y] == 0) & (self.walls[changing, 1, x, y] == 0)
+        build = changing[empty]
+        self.walls[build, current_player[build], x[empty], y[empty]] = 1
+        self.walls[changing[~empty], :, x[~empty], y[~empty]] = 0
+        self._update_scores(changing)
+
+        self.agent_current_idx = (self.agent_current_idx + 1) % self.num_agents
+        switched = np.nonzero(self.agent_current_idx == 0)[0]
+        self.current_player[switched] ^= 1
+        self._sort_agent_coords(switched)
+        self.remaining_turns[switched[self.current_player[switched] == 0]] -= 1
+        return valid
+
+    def _sort_agent_coords(self, games):
+        """
+        Lists the agents of the given games at their current positions in row-major order,
+        as Map.update_agent_coords_in_order() does
+        """
+        coords = self.agent_positions[games]
+        keys = np.where(coords[..., 0] >= 0, coords[..., 0] * self.width + coords[..., 1],
+                        self.height * self.width)
+        order = np.argsort(keys, axis=-1)
+        self.agent_coords[games] = np.take_along_axis(coords, order[..., None], axis=2)
+        self.agent_positions[games] = self.agent_coords[games]
+
+    def step(self, actions):
+        """
+        Applies one action per game and returns the batched next state, the rewards of
+        AgentFighting.step() and the done flags. Finished games are reset before returning
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        games = np.arange(self.num_envs)
+        current_player = self.current_player.copy()
+        current_agent_idx = self.agent_current_idx.copy()
+
+        previous_scores = self.scores
+        diff_previous_scores = previous_scores[games, current_player] - previous_scores[games, 1 - current_player]
+        self._next(actions)
+        new_scores = self.scores
+        diff_new_score = new_scores[games, current_player] - new_scores[games, 1 - current_player]
+
+        rewards = np.where(diff_new_score > 0, 0.25, -0.5)
+        rewards += np.where(diff_new_score != diff_previous_scores,
+                            diff_new_score - diff_previous_scores, -0.1)
+        next_xy = self.agent_coords[games, current_player, current_agent_idx]
+        on_territory = self.territories[games, current_player, next_xy[:, 0], next_xy[:, 1]] == 1
+        rewards += np.where(on_territory, -0.25, 0.15)
+        on_border = (next_xy[:, 0] == 0) | (next_xy[:, 0] == self.heights - 1) | \
+            (next_xy[:, 1] == 0) | (next_xy[:, 1] == self.widths - 1)
+        rewards -= np.where(on_border, 0.2, 0)
+
+        dones = self.is_terminal()
+        finished = np.nonzero(dones)[0]
+        self.final_scores[finished] = new_scores[finished]
+        self._reset_games(finished)
+        return self.get_state(), rewards, dones
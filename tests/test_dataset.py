@@ -0,0 +1,54 @@
+"""
+Transitions written by DatasetWriter shards and read back by DatasetReader.
+"""
+import numpy as np
+from src.dataset import DatasetReader, DatasetWriter
+
+
+def transitions(n, seed):
+    rng = np.random.default_rng(seed)
+    return [(rng.integers(-1, 2, size=(9, 5, 5)), rng.random(13) < 0.5, int(rng.integers(13)),
+             float(rng.normal()), i % 7 == 6) for i in range(n)]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path)
+    written = {}
+    # two writers of different names in the same directory, with several shards each
+    for name, n in (('a', 23), ('b', 10)):
+        with DatasetWriter(path, name=name, shard_size=8) as writer:
+            written[name] = transitions(n, seed=len(written))
+            for transition in written[name]:
+                writer.append(*transition)
+        assert len(writer) == n
+    rows = written['a'] + written['b']
+
+    reader = DatasetReader(path)
+    assert len(reader) == len(rows)
+    batch = reader.get(np.arange(len(rows))[::-1])
+    assert batch['observation'].dtype == np.int8 and batch['reward'].dtype == np.float32
+    for i, (observation, valid_actions, action, reward, done) in enumerate(rows):
+        assert (batch['observation'][i] == observation).all()
+        assert (batch['valid_actions'][i] == valid_actions).all()
+        assert batch['action'][i] == action
+        assert batch['reward'][i] == np.float32(reward)
+        assert batch['done'][i] == done
+
+    batches = list(reader.batches(5, rng=np.random.default_rng(0)))
+    assert [len(batch['action']) for batch in batches] == [5] * 6 + [3]
+    rewards = np.sort(np.concatenate([batch['reward'] for batch in batches]))
+    assert (rewards == np.sort(np.float32([reward for *_, reward, _ in rows]))).all()
+    assert len(list(reader.batches(5, drop_last=True))) == 6
+
+
+def test_reader_sees_flushed_transitions(tmp_path):
+    path = str(tmp_path)
+    writer = DatasetWriter(path, shard_size=8)
+    for transition in transitions(12, seed=0):
+        writer.append(*transition)
+    writer.flush()
+    for transition in transitions(3, seed=1):
+        writer.append(*transition)
+    assert len(DatasetReader(path)) == 12
+    writer.close()
+    assert len(DatasetReader(path)) == 15
@@ -0,0 +1,158 @@
+"""
+Differential test of the EndgameSolver: its value is compared with a plain minimax to the end
+of the game, over the valid actions and staying, on small random positions with enclosures.
+"""
+import json
+import os
+import numpy as np
+import pytest
+from algorithms.AlphaBeta import EndgameSolver
+from src.bitboard import BitboardState
+from src.environment import AgentFighting
+from src.player import Player
+from src.state import State
+
+CONFIGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs', 'map.json')
+ENGINES = [State, BitboardState]
+
+
+def new_state(engine, castles, ponds, agent_coords, n_turns, walls):
+    configs = json.load(open(CONFIGS))
+    action_space = AgentFighting(None, configs).action_space
+    state = engine(configs['map'], action_space)
+    state.set_players([Player(player, 2) for player in range(2)])
+    state.set_map(castles, ponds, agent_coords, n_turns)
+    state.set_layers(state.agents.copy(), walls, castles, np.zeros_like(walls), ponds)
+    state.update_score()
+    return state
+
+
+def random_position(engine, seed, num_agents, n_turns):
+    """
+    A 7x7 map with a few castles and ponds, rectangles of walls of both players and
+    scattered walls, where breaking or closing an enclosure changes the scores
+    """
+    rng = np.random.default_rng(seed)
+    height = width = 7
+    cells = rng.permutation(height * width)
+    castles = np.zeros((height, width), dtype=np.int8)
+    ponds = np.zeros((height, width), dtype=np.int8)
+    castles.flat[cells[:3]] = 1
+    ponds.flat[cells[3:5]] = 1
+    coords = [divmod(int(cell), width) for cell in cells[5:5 + 2 * num_agents]]
+    agent_coords = [coords[:num_agents], coords[num_agents:]]
+    free = np.ones((height, width), dtype=bool)
+    free.flat[cells[:5 + 2 * num_agents]] = False
+    owner = np.where(rng.random((height, width)) < 0.15, rng.integers(0, 2, size=(height, width)), -1)
+    for rectangle in range(3):
+        x, y = rng.integers(0, height - 2), rng.integers(0, width - 2)
+        x2, y2 = rng.integers(x + 2, min(x + 5, height)), rng.integers(y + 2, min(y + 5, width))
+        outline = np.zeros((height, width), dtype=bool)
+        outline[x:x2 + 1, y:y2 + 1] = True
+        outline[x + 1:x2, y + 1:y2] = False
+        owner[outline] = rng.integers(0, 2)
+        # walls of the other player inside, which are territory only while enclosed
+        owner[x + 1:x2, y + 1:y2][rng.random((x2 - x - 1, y2 - y - 1)) < 0.5] = 1 - owner[x, y]
+    walls = np.stack([free & (owner == player) for player in range(2)]).astype(np.int8)
+    return new_state(engine, castles, ponds, agent_coords, n_turns, walls)
+
+
+def legal_actions(state):
+    return [int(action) for action in np.flatnonzero(state.valid_action_mask())] + [state.n_actions - 1]
+
+
+def minimax(state):
+    """
+    Final score difference for the player to move under best play of both players
+    """
+    if state.is_terminal():
+        scores = state.scores
+        return float(scores[state.current_player] - scores[1 - state.current_player])
+    player = state.current_player
+    best = -float('inf')
+    for action in legal_actions(state):
+        state.push(action)
+        try:
+            value = minimax(state) if state.current_player == player else -minimax(state)
+        finally:
+            state.pop()
+        best = max(best, value)
+    return best
+
+
+def final_score_ranges(state, solver):
+    """
+    Returns the lowest and highest final score of each player over every line from the state,
+    checking on the way that they lie within the bounds of the solver at every node
+    """
+    if state.is_terminal():
+        return [(state.scores[player], state.scores[player]) for player in range(2)]
+    ranges = [(float('inf'), -float('inf'))] * 2
+    for action in legal_actions(state):
+        state.push(action)
+        try:
+            child_ranges = final_score_ranges(state, solver)
+        finally:
+            state.pop()
+        ranges = [(min(low, child_low), max(high, child_high))
+                  for (low, high), (child_low, child_high) in zip(ranges, child_ranges)]
+    player = state.current_player
+    own_plies, opponent_plies = solver.remaining_plies(state)
+    for bounds_player, plies in ((player, (own_plies, opponent_plies)), (1 - player, (opponent_plies, own_plies))):
+        low, high = solver.score_bounds(state, bounds_player, *plies)
+        assert low <= ranges[bounds_player][0] and ranges[bounds_player][1] <= high
+    return ranges
+
+
+def check_solver(state):
+    solver = EndgameSolver(n_actions=state.n_actions, num_agents=state.num_agents)
+    action, value = solver.solve(state)
+    expected = minimax(state)
+    assert value == expected
+    player = state.current_player
+    state.push(action)
+    try:
+        assert (minimax(state) if state.current_player == player else -minimax(state)) == expected
+    finally:
+        state.pop()
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('seed', range(12))
+def test_solver_matches_minimax(engine, seed):
+    # 1 agent and 2 turns, or 2 agents and 1 turn, from the first or the second ply
+    num_agents = 1 + seed % 2
+    state = random_position(engine, seed, num_agents, 3 - num_agents)
+    check_solver(state)
+    state.next(legal_actions(state)[0])
+    check_solver(state)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('seed', range(12))
+def test_score_bounds_hold(engine, seed):
+    num_agents = 1 + seed % 2
+    state = random_position(engine, seed, num_agents, 3 - num_agents)
+    solver = EndgameSolver(n_actions=state.n_actions, num_agents=state.num_agents)
+    solver.solve(state)
+    final_score_ranges(state, solver)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_solver_sees_enclosure_broken(engine):
+    # the ring of player 0 encloses walls of player 1, which stop being territory of player 0
+    # as soon as player 1 destroys a wall of the ring in the last ply
+    height = width = 11
+    walls = np.zeros((2, height, width), dtype=np.int8)
+    walls[0, 2:9, 2:9] = 1
+    walls[0, 3:8, 3:8] = 0
+    walls[1, 3:8, 3:8] = 1
+    empty = np.zeros((height, width), dtype=np.int8)
+    state = new_state(engine, empty, empty.copy(), [[(10, 10)], [(1, 5)]], 1, walls)
+    state.next(state.n_actions - 1)
+    assert state.scores[0] == 149
+    solver = EndgameSolver(n_actions=state.n_actions, num_agents=state.num_agents)
+    action, value = solver.solve(state)
+    assert value == minimax(state)
+    assert state.get_type_action(action) == ('Change', 'D')
+    assert final_score_ranges(state, solver)[0] == (23, 149)
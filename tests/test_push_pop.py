@@ -0,0 +1,60 @@
+"""
+push()/pop() on every scoring backend and BitboardState, in and out of rollout mode: random
+sequences of pushes and pops must bring back the exact state of before each push.
+"""
+import random
+import numpy as np
+import pytest
+from test_scoring import make_states
+
+
+def snapshot(state):
+    return (
+        [[int(value) for value in values] for values in (
+            state.wall_scores, state.castle_scores, state.open_territory_scores,
+            state.closed_territory_scores, state.territory_scores)],
+        np.array(state.agents).tobytes(), np.array(state.walls).tobytes(),
+        np.array(state.territories).tobytes(),
+        state.current_player, state.agent_current_idx, state.remaining_turns,
+        [list(coords) for coords in state.agent_coords_in_order],
+        state.valid_action_masks().tobytes(), state.zobrist_hash,
+    )
+
+
+def random_action(state, rng):
+    mask = state.valid_action_mask()
+    changes = [int(action) for action in np.flatnonzero(mask) if action >= state.n_moves]
+    moves = [int(action) for action in np.flatnonzero(mask) if action < state.n_moves]
+    if changes and rng.random() < 0.6:
+        return rng.choice(changes)
+    if moves and rng.random() < 0.9:
+        return rng.choice(moves)
+    return rng.randrange(state.n_actions)
+
+
+@pytest.mark.parametrize('rollout', [False, True])
+@pytest.mark.parametrize('seed', range(4))
+def test_pop_restores_pushed_state(seed, rollout):
+    rng = random.Random(seed)
+    states = make_states(seed, rng.randint(12, 16), rng.randint(12, 16))
+    for state in states:
+        name = type(state).__name__ + ' ' + str(state.scoring)
+        rng = random.Random(seed)
+        start = snapshot(state)
+        state.set_rollout_mode(rollout)
+        snapshots = [snapshot(state)]
+        for step in range(400):
+            if len(snapshots) > 1 and (state.is_terminal() or rng.random() < 0.4):
+                state.pop()
+                snapshots.pop()
+                assert snapshot(state) == snapshots[-1], name
+            else:
+                state.push(random_action(state, rng))
+                snapshots.append(snapshot(state))
+                assert state.zobrist_hash == state.compute_zobrist(), name
+        while len(snapshots) > 1:
+            state.pop()
+            snapshots.pop()
+            assert snapshot(state) == snapshots[-1], name
+        state.set_rollout_mode(False)
+        assert snapshot(state) == start, name
@@ -0,0 +1,67 @@
+"""
+Games recorded by a Recorder as a frame archive and as one GIF per game.
+"""
+import json
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('pygame')
+from src.environment import AgentFighting
+from src.recorder import Recorder
+
+CONFIGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs', 'map.json')
+
+
+def play_games(recorder, n_games, n_turns=3):
+    """
+    Plays n_games short games on 11x11 maps, the last one stopped before its end,
+    returns the number of frames of the games played to the end
+    """
+    configs = json.load(open(CONFIGS))
+    configs['map'].update({'height-min': 11, 'height-max': 11, 'width-min': 11, 'width-max': 11,
+                           'min-num-turns': n_turns, 'max-num-turns': n_turns})
+    env = AgentFighting(None, configs, seed=0, recorder=recorder)
+    for game in range(n_games):
+        if game > 0:
+            env.reset()
+        while not env.is_terminal():
+            env.step(env.n_actions - 1)
+    env.reset()
+    env.step(env.n_actions - 1)
+    # one frame at the start and one at the end of the turn of each player
+    return n_games * (1 + 2 * n_turns)
+
+
+def test_frame_archive(tmp_path):
+    path = str(tmp_path / 'games.npz')
+    with Recorder(path, queue_size=1000) as recorder:
+        n_frames = play_games(recorder, 2)
+    assert recorder.dropped == 0
+    with np.load(path) as frames:
+        assert len(frames.files) == recorder.n_frames == n_frames + 1
+        frame = frames['frame_{:06d}'.format(n_frames - 1)]
+    assert frame.dtype == np.uint8 and frame.ndim == 3 and frame.shape[2] == 3
+
+
+def test_frames_dropped_without_blocking(tmp_path):
+    path = str(tmp_path / 'games.npz')
+    with Recorder(path, queue_size=0) as recorder:
+        n_frames = play_games(recorder, 2)
+    # only the last frames of the games played to the end are queued
+    assert recorder.n_frames == 2
+    assert recorder.n_frames + recorder.dropped == n_frames + 1
+
+
+def test_one_gif_per_game(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    path = str(tmp_path / 'games.gif')
+    with Recorder(path, queue_size=1000, max_frames=5) as recorder:
+        n_frames = play_games(recorder, 2)
+    # games of 7 frames are split in parts of 5 and 2 frames, the stopped game is one more part
+    names = sorted(os.listdir(str(tmp_path)))
+    assert names == ['games_{:04d}.gif'.format(n) for n in range(5)]
+    assert recorder.n_frames == n_frames + 1
+    for name in names:
+        with Image.open(str(tmp_path / name)) as image:
+            assert image.n_frames >= 1
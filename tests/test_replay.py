@@ -0,0 +1,72 @@
+"""
+Games recorded by a GameLog, saved, loaded and replayed with Replay on both engines.
+"""
+import json
+import os
+import random
+import numpy as np
+import pytest
+from src.environment import AgentFighting
+from src.replay import GameLog
+
+CONFIGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs', 'map.json')
+
+
+def position(state):
+    return (np.array(state.agents).tobytes(), np.array(state.walls).tobytes(),
+            np.array(state.territories).tobytes(), tuple(state.scores), state.current_player,
+            state.agent_current_idx, state.remaining_turns, state.zobrist_hash)
+
+
+def play_games(env, n_games, seed):
+    """
+    Plays n_games random games, returns the positions before every step and at the end of each
+    """
+    rng = random.Random(seed)
+    games = []
+    for game in range(n_games):
+        if game > 0:
+            env.reset()
+        positions = []
+        while not env.is_terminal():
+            positions.append(position(env.state))
+            valid = np.flatnonzero(env.state.valid_action_mask())
+            env.step(int(rng.choice(valid)) if len(valid) and rng.random() < 0.9 else env.n_actions - 1)
+        positions.append(position(env.state))
+        games.append(positions)
+    return games
+
+
+@pytest.mark.parametrize('engine', ['array', 'bitboard'])
+def test_replay_round_trip(tmp_path, engine):
+    configs = json.load(open(CONFIGS))
+    configs['map'].update({'min-num-turns': 20, 'max-num-turns': 30})
+    log = GameLog()
+    env = AgentFighting(None, configs, engine=engine, seed=1, game_log=log)
+    games = play_games(env, 3, seed=1)
+    path = str(tmp_path / 'games.npz')
+    log.save(path)
+    loaded = GameLog.load(path)
+    assert len(loaded) == len(games)
+    rng = random.Random(0)
+    for game, positions in enumerate(games):
+        replay = loaded.replay(game, env.new_state(), interval=8)
+        assert len(replay) == len(positions) - 1
+        # seeking back and forth reuses the checkpoints of the steps replayed before
+        steps = [len(replay)] + rng.sample(range(len(replay)), 10) + [0]
+        for step in steps:
+            assert position(replay.state_at(step)) == positions[step]
+        for step, state in replay.states():
+            assert position(state) == positions[step]
+
+
+def test_replay_rejects_wrong_agent():
+    configs = json.load(open(CONFIGS))
+    log = GameLog()
+    env = AgentFighting(None, configs, seed=2, game_log=log)
+    env.step(env.n_actions - 1)
+    env.step(env.n_actions - 1)
+    replay = log.replay(0, env.new_state())
+    state = replay.state_at(1)
+    with pytest.raises(ValueError):
+        replay.play(state, 0)
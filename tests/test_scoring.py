@@ -0,0 +1,86 @@
+"""
+Differential test of the scoring backends: seeded games starting from random walls, with
+mostly wall changes, are played on every backend and BitboardState, and every score component and the territories are
+compared at every step with get_scores() on a copy of the state.
+"""
+import json
+import os
+import random
+from copy import deepcopy as dcopy
+import numpy as np
+import pytest
+from src.bitboard import BitboardState
+from src.environment import AgentFighting
+from src.player import Player
+from src.state import State
+
+CONFIGS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs', 'map.json')
+
+
+def make_states(seed, height, width):
+    configs = json.load(open(CONFIGS))
+    configs['map'].update({'height-min': height, 'height-max': height, 'width-min': width, 'width-max': width})
+    env = AgentFighting(None, configs, engine='array', seed=seed)
+    game_map = (env.state.castles.copy(), env.state.ponds.copy(),
+                [list(coords) for coords in env.state.agent_coords_in_order], env.state.n_turns)
+    states = [State(configs['map'], env.action_space, scoring=scoring) for scoring in State.scoring_backends]
+    states.append(BitboardState(configs['map'], env.action_space))
+    # start from rectangles of walls, which enclose regions, and walls scattered on the free cells
+    rng = np.random.default_rng(seed)
+    free = (env.state.castles == 0) & (env.state.ponds == 0) & (env.state.agents.sum(axis=0) == 0)
+    owner = np.where(rng.random(free.shape) < 0.2, rng.integers(0, env.num_players, size=free.shape), -1)
+    for rectangle in range(8):
+        x, y = rng.integers(0, height - 2), rng.integers(0, width - 2)
+        x2, y2 = rng.integers(x + 2, min(x + 7, height)), rng.integers(y + 2, min(y + 7, width))
+        outline = np.zeros(free.shape, dtype=bool)
+        outline[x:x2 + 1, y:y2 + 1] = True
+        outline[x + 1:x2, y + 1:y2] = False
+        owner[outline] = rectangle % env.num_players
+    walls = np.stack([free & (owner == player) for player in range(env.num_players)]).astype(np.int8)
+    for state in states:
+        state.set_players([Player(player, env.num_players) for player in range(env.num_players)])
+        state.set_map(*game_map)
+        state.set_layers(state.agents.copy(), walls, game_map[0], np.zeros_like(walls), game_map[1])
+        state.update_score()
+    return states
+
+
+def score_components(state):
+    return [[int(value) for value in values] for values in (
+        state.wall_scores, state.castle_scores, state.open_territory_scores, state.closed_territory_scores)]
+
+
+def reference_components(state):
+    reference = dcopy(state)
+    components = [[], [], [], []]
+    for player in range(reference.num_players):
+        wall_score, closed_territory_score, open_territory_score, castle_score = reference.get_scores(player)
+        for values, value in zip(components, (wall_score, castle_score, open_territory_score, closed_territory_score)):
+            values.append(int(value))
+    return components, np.array(reference.territories)
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_backends_match_get_scores(seed):
+    rng = random.Random(seed)
+    states = make_states(seed, rng.randint(12, 18), rng.randint(12, 18))
+    n_moves = states[0].n_moves
+    while not states[0].is_terminal():
+        mask = states[0].valid_action_mask()
+        changes = [action for action in np.flatnonzero(mask) if action >= n_moves]
+        moves = [action for action in np.flatnonzero(mask) if action < n_moves]
+        # mostly wall changes, which build and destroy walls, with moves to reach new cells
+        if changes and rng.random() < 0.7:
+            action = int(rng.choice(changes))
+        elif moves:
+            action = int(rng.choice(moves))
+        else:
+            action = rng.randrange(states[0].n_actions)
+        valid = [state.next(action) for state in states]
+        assert len(set(valid)) == 1
+
+        components, territories = reference_components(states[0])
+        for state in states:
+            assert score_components(state) == components, type(state).__name__ + ' ' + str(state.scoring)
+            assert (np.array(state.territories) == territories).all()
+            assert state.zobrist_hash == states[0].zobrist_hash